@@ -4,6 +4,8 @@ import json
 import time
 from concurrent.futures import ProcessPoolExecutor, as_completed
 
+from corpus_io import base_name, open_text
+
 def process_line(data, input_filename, id_prefix, id_counter, min_words, min_edu_score):
     try:
         data = json.loads(data)
@@ -54,7 +56,7 @@ def process_line(data, input_filename, id_prefix, id_counter, min_words, min_edu
 
     # Validate doc_type
     if 'doc_type' not in data:
-        data['doc_type'] = os.path.splitext(os.path.basename(input_filename))[0]
+        data['doc_type'] = base_name(input_filename)
 
     # Only keep specific fields
     valid_data = {
@@ -104,13 +106,13 @@ def main():
 
     input_filename = os.path.basename(args.input_file)
     output_filename = os.path.join(args.output_dir, input_filename)
-    id_prefix = f"{os.path.splitext(input_filename)[0]}_"
+    id_prefix = f"{base_name(input_filename)}_"
 
     id_counter = [1]
 
     print(f"Opening {args.input_file}")
 
-    with open(args.input_file, 'r') as infile, open(output_filename, 'w') as outfile:
+    with open_text(args.input_file) as infile, open_text(output_filename, 'w') as outfile:
         chunk_generator = read_in_chunks(infile, chunk_size=1000)
         
         with ProcessPoolExecutor(max_workers=num_cores) as executor:
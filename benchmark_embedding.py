@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+"""
+Measures embedding throughput of calculate_distance_convert_jsonlines.py
+configurations on this machine, so the backend, quantisation and number of
+worker processes can be chosen per node.
+
+Every combination of --backends, --quantize and --num_workers is run on the
+same sentences. The first configuration is the reference for the reported
+cosine agreement of the others.
+"""
+
+import argparse
+import itertools
+import time
+
+import numpy as np
+
+from calculate_distance_convert_jsonlines import MODEL_NAME, read_parallel_corpus, sentence_encoder
+
+def load_sentences(input_file, num_sentences):
+    if input_file:
+        return [entry['norwegian'] for entry in read_parallel_corpus(input_file, num_sentences)]
+    words = "dette er en setning om norsk språk og maskinoversettelse med litt variasjon i lengde".split()
+    rng = np.random.default_rng(0)
+    return [" ".join(rng.choice(words, size=rng.integers(5, 60))) for _ in range(num_sentences)]
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark embedding throughput for different CPU configurations.')
+    parser.add_argument('--input_file', type=str, help='Parallel corpus TSV to take sentences from. Synthetic sentences are used if omitted.')
+    parser.add_argument('--num_sentences', type=int, default=2000, help='Number of sentences to embed per configuration.')
+    parser.add_argument('--batch_size', type=int, default=64, help='Batch size for the embedding model.')
+    parser.add_argument('--backends', nargs='+', choices=['torch', 'onnx'], default=['torch'], help='Backends to try.')
+    parser.add_argument('--quantize', nargs='+', choices=['none', 'int8'], default=['none', 'int8'], help='Quantisation modes to try.')
+    parser.add_argument('--num_workers', nargs='+', type=int, default=[1, 4], help='Worker process counts to try.')
+    parser.add_argument('--threads_per_worker', type=int, help='Threads per worker process. Defaults to the cores divided by the worker count.')
+    args = parser.parse_args()
+
+    sentences = load_sentences(args.input_file, args.num_sentences)
+    print(f"Embedding {len(sentences)} sentences with {MODEL_NAME}, batch size {args.batch_size}")
+    print("| Backend | Quantize | Workers | Sentences/s | Min cosine vs reference |")
+    print("| --- | --- | ---: | ---: | ---: |")
+
+    reference = None
+    for backend, quantize, num_workers in itertools.product(args.backends, args.quantize, args.num_workers):
+        quantize = None if quantize == 'none' else quantize
+        if quantize and backend != 'torch':
+            continue
+        with sentence_encoder(MODEL_NAME, args.batch_size, backend, quantize, num_workers, args.threads_per_worker) as encode_fn:
+            # Warm up so model loading and worker start-up are not timed.
+            encode_fn(sentences[:max(num_workers, 1) * args.batch_size])
+            start = time.perf_counter()
+            embeddings = encode_fn(sentences)
+            elapsed = time.perf_counter() - start
+        if reference is None:
+            reference = embeddings
+        agreement = float(np.einsum('ij,ij->i', reference, embeddings).min())
+        print(f"| {backend} | {quantize or 'fp32'} | {num_workers} | {len(sentences) / elapsed:.1f} | {agreement:.4f} |")
+
+if __name__ == "__main__":
+    main()
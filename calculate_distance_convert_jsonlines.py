@@ -1,72 +1,284 @@
 import argparse
+import contextlib
+import functools
+import itertools
 import json
+import multiprocessing
+import os
 import re
-import torch
-from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 from tqdm import tqdm
 
+from corpus_io import COMPRESSION_SUFFIXES, open_text, recover_appendable
+from embedding_cache import EmbeddingCache
+
+MODEL_NAME = 'sentence-transformers/LaBSE'
+
+JSONL_SUFFIXES = tuple('.jsonl' + suffix for suffix in ('',) + COMPRESSION_SUFFIXES)
+
 def read_parallel_corpus(input_file, max_num_lines=None):
-    data = []
-    with open(input_file, 'r', encoding='utf-8') as file:
+    """
+    Lazily yields the English/Norwegian pairs of a TSV file, or the records of
+    a jsonlines file written by an earlier --only_number_check run.
+    """
+    jsonl = input_file.endswith(JSONL_SUFFIXES)
+    with open_text(input_file) as file:
         for idx, line in enumerate(file):
             if max_num_lines and idx >= max_num_lines:
                 break
+            if jsonl:
+                yield json.loads(line)
+                continue
             english, norwegian = line.strip().split('\t')
-            data.append({"english": english, "norwegian": norwegian})
-    return data
+            yield {"english": english, "norwegian": norwegian}
+
+def read_windows(entries, window_size):
+    entries = iter(entries)
+    while True:
+        window = list(itertools.islice(entries, window_size))
+        if not window:
+            return
+        yield window
+
+def write_jsonlines(data, file):
+    for entry in data:
+        file.write(json.dumps(entry) + '\n')
+
+SEPARATOR_PATTERN = re.compile(r'[^\d]')
+# Per language: (decimal separator, thousands separators).
+NUMBER_LOCALES = {
+    'english': ('.', (',', '\u00a0', '\u202f')),
+    'norwegian': (',', ('.', ' ', '\u00a0', '\u202f')),
+}
+
+def number_pattern(space_separators):
+    """
+    A run of digits joined by '.' or ',', as in '1,000.5', '1.000' or '3,5', or
+    thousands grouped by one of space_separators, as in '1 000,5'. Space
+    grouping needs 1-3 leading digits and groups of exactly three, so two
+    numbers next to each other, as in 'In 2019 100 people', stay apart.
+    """
+    spaces = ''.join(space_separators)
+    return re.compile(rf'(?<!\d)\d{{1,3}}(?:[{spaces}]\d{{3}}(?!\d))+(?:[.,]\d+)?|\d+(?:[.,]\d+)*')
+
+# Plain spaces group thousands in Norwegian but not in English, where only non-breaking and thin spaces do.
+NUMBER_PATTERNS = {locale: number_pattern([s for s in thousands if s.isspace()])
+                   for locale, (_, thousands) in NUMBER_LOCALES.items()}
+
+def normalise_number(number, locale):
+    """
+    Rewrites a NUMBER_PATTERNS match as a plain decimal: '1 000,50' in Norwegian
+    and '1,000.5' in English both become '1000.5'. A thousands separator
+    counts only when exactly three digits follow; otherwise it is read as the
+    decimal separator, as in a Norwegian '3.5' copied from English. Anything
+    after the fraction, as in a date '12.05.2020' or a version '1.2.30', is
+    kept verbatim, and then the fraction is not trimmed either.
+    """
+    if number.isdigit():
+        return number.lstrip('0') or '0'
+    decimal_separator, thousands_separators = NUMBER_LOCALES[locale]
+    parts = SEPARATOR_PATTERN.split(number)
+    separators = SEPARATOR_PATTERN.findall(number)
+    integer, fraction, rest = parts[0], None, []
+    for separator, part in zip(separators, parts[1:]):
+        if fraction is None and separator in thousands_separators and len(part) == 3:
+            integer += part
+        elif fraction is None:
+            fraction = part
+        else:
+            rest.append(part)
+    integer = integer.lstrip('0') or '0'
+    if rest:
+        return '.'.join([integer, fraction] + rest)
+    # Only a real decimal fraction loses its trailing zeros: '2,50' -> '2.5'
+    fraction = fraction.rstrip('0') if fraction is not None else ''
+    return f"{integer}.{fraction}" if fraction else integer
 
-def write_jsonlines(data, output_file):
-    with open(output_file, 'a', encoding='utf-8') as file:
-        for entry in data:
-            file.write(json.dumps(entry) + '\n')
+def extract_numbers_batch(texts, locale):
+    """
+    Returns the sorted normalised numbers of every text, running the locale's pattern
+    once over the whole batch and bucketing the matches by line offset.
+    """
+    joined = '\n'.join(texts)
+    line_starts = np.cumsum([0] + [len(text) + 1 for text in texts[:-1]])
+    numbers = [[] for _ in texts]
+    matches = list(NUMBER_PATTERNS[locale].finditer(joined))
+    if matches:
+        lines = np.searchsorted(line_starts, [m.start() for m in matches], side='right') - 1
+        for line, match in zip(lines.tolist(), matches):
+            numbers[line].append(normalise_number(match.group(), locale))
+    for line_numbers in numbers:
+        line_numbers.sort()
+    return numbers
 
-def extract_numbers(text):
-    return re.findall(r'\d+', text)
+def number_mismatches(data):
+    """
+    Flags pairs whose English and Norwegian sides do not contain the same
+    numbers. Order is ignored, since translation often reorders them.
+    """
+    english_numbers = extract_numbers_batch([entry['english'] for entry in data], 'english')
+    norwegian_numbers = extract_numbers_batch([entry['norwegian'] for entry in data], 'norwegian')
+    return [en != no for en, no in zip(english_numbers, norwegian_numbers)]
 
-def calculate_semantic_distance_batch(data, model, only_embedding_model, device):
+@functools.lru_cache(maxsize=None)
+def load_model(model_name, backend="torch", quantize=None, device=None):
+    """
+    Loads the model on first use, so fully cached runs never import torch.
+
+    backend "onnx" runs the ONNX export through onnxruntime. quantize "int8"
+    applies dynamic int8 quantisation to the Linear layers, which only runs on CPU.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+    if device is None:
+        device = "cuda" if torch.cuda.is_available() and quantize is None else "cpu"
+    model = SentenceTransformer(model_name, device=device, backend=backend)
+    if quantize == "int8":
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return model
+
+def encode_sorted(model, sentences, batch_size):
+    """
+    Encodes sentences longest first so each batch pads to similar lengths, and
+    returns L2-normalised embeddings in the original order.
+    """
+    order = np.argsort([-len(sentence) for sentence in sentences], kind='stable')
+    embeddings = model.encode([sentences[i] for i in order], batch_size=batch_size,
+                              normalize_embeddings=True, convert_to_numpy=True)
+    restored = np.empty_like(embeddings)
+    restored[order] = embeddings
+    return restored
+
+def _init_encode_worker(num_threads):
+    # Pin the thread pools before torch is imported in this process.
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ[var] = str(num_threads)
+    import torch
+    torch.set_num_threads(num_threads)
+
+def _encode_chunk(sentences, model_name, batch_size, backend, quantize):
+    return encode_sorted(load_model(model_name, backend, quantize, "cpu"), sentences, batch_size)
+
+@contextlib.contextmanager
+def sentence_encoder(model_name, batch_size, backend="torch", quantize=None, num_workers=1, threads_per_worker=None):
+    """
+    Yields a function mapping a list of sentences to normalised embeddings.
+
+    With num_workers > 1 each window is split over that many CPU worker
+    processes, each loading its own copy of the model and limited to
+    threads_per_worker threads (default: the cores divided evenly). Workers
+    start on the first call, so a fully cached run never spawns them.
+    """
+    if num_workers <= 1:
+        yield lambda sentences: encode_sorted(load_model(model_name, backend, quantize), sentences, batch_size)
+        return
+
+    threads_per_worker = threads_per_worker or max(1, os.cpu_count() // num_workers)
+    with ProcessPoolExecutor(max_workers=num_workers, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=_init_encode_worker, initargs=(threads_per_worker,)) as executor:
+        def encode_fn(sentences):
+            # Deal the length-sorted sentences round-robin so every worker gets a similar share of long ones.
+            order = np.argsort([-len(sentence) for sentence in sentences], kind='stable')
+            chunks = [order[w::num_workers] for w in range(num_workers) if len(order[w::num_workers])]
+            results = executor.map(_encode_chunk, [[sentences[i] for i in chunk] for chunk in chunks],
+                                   itertools.repeat(model_name), itertools.repeat(batch_size),
+                                   itertools.repeat(backend), itertools.repeat(quantize))
+            embeddings = None
+            for chunk, chunk_embeddings in zip(chunks, results):
+                if embeddings is None:
+                    embeddings = np.empty((len(sentences), chunk_embeddings.shape[1]), dtype=chunk_embeddings.dtype)
+                embeddings[chunk] = chunk_embeddings
+            return embeddings
+        yield encode_fn
+
+def embed_sentences(sentences, encode_fn, cache=None):
+    if cache is None:
+        return encode_fn(sentences)
+    return cache.encode(sentences, encode_fn)
+
+def calculate_semantic_distance_batch(data, embed):
     english_sentences = [entry['english'] for entry in data]
     norwegian_sentences = [entry['norwegian'] for entry in data]
     
-    english_embeddings = model.encode(english_sentences, batch_size=len(english_sentences), device=device)
-    norwegian_embeddings = model.encode(norwegian_sentences, batch_size=len(norwegian_sentences), device=device)
+    english_embeddings = embed(english_sentences)
+    norwegian_embeddings = embed(norwegian_sentences)
     
-    distances = cosine_similarity(english_embeddings, norwegian_embeddings)
+    # Row-wise cosine similarity of normalised embeddings: O(N) instead of the full N x N matrix
+    similarities = np.einsum('ij,ij->i', english_embeddings, norwegian_embeddings)
     
-    for i, entry in enumerate(data):
-        semantic_distance = 1 - distances[i][i]
-        if not only_embedding_model:
-            english_numbers = extract_numbers(entry['english'])
-            norwegian_numbers = extract_numbers(entry['norwegian'])
-            if english_numbers != norwegian_numbers:
-                semantic_distance = 1.0
-        entry['semantic_distance'] = semantic_distance
+    for entry, similarity in zip(data, similarities.tolist()):
+        entry['semantic_distance'] = 1 - similarity
     
     return data
 
-def process_in_batches(data, model, batch_size, only_embedding_model, max_distance_score, output_file, device):
-    for i in tqdm(range(0, len(data), batch_size)):
-        batch = data[i:i+batch_size]
-        processed_batch = calculate_semantic_distance_batch(batch, model, only_embedding_model, device)
-        filtered_batch = [entry for entry in processed_batch if entry['semantic_distance'] <= max_distance_score]
-        write_jsonlines(filtered_batch, output_file)
+def process_in_windows(entries, embed, window_size, check_numbers, drop_number_mismatch, max_distance_score, output_file):
+    """
+    Flags number mismatches first, so with drop_number_mismatch those pairs
+    are never embedded. With embed set to None only the number check runs.
+    """
+    total = kept = mismatched = 0
+    # An interrupted earlier run may have left an incomplete line or compressed frame to append after
+    recover_appendable(output_file)
+    with open_text(output_file, 'a') as file:
+        for window in tqdm(read_windows(entries, window_size), unit="window"):
+            total += len(window)
+            if check_numbers:
+                for entry, mismatch in zip(window, number_mismatches(window)):
+                    entry['number_mismatch'] = mismatch
+                    mismatched += mismatch
+                if drop_number_mismatch:
+                    window = [entry for entry in window if not entry['number_mismatch']]
+            if embed is not None and window:
+                window = calculate_semantic_distance_batch(window, embed)
+                window = [entry for entry in window if entry['semantic_distance'] <= max_distance_score]
+            kept += len(window)
+            write_jsonlines(window, file)
+    print(f"Processed {total} pairs: {mismatched} with mismatched numbers, {kept} written to {output_file}.")
 
 def main():
     parser = argparse.ArgumentParser(description='Convert parallel corpus to JSON lines and calculate semantic distance.')
-    parser.add_argument('--input_file', type=str, required=True, help='Input file containing the parallel corpus.')
+    parser.add_argument('--input_file', type=str, required=True, help='Input file containing the parallel corpus: a TSV file, or the jsonlines output of --only_number_check.')
     parser.add_argument('--output_file', type=str, required=True, help='Output file to save the JSON lines.')
     parser.add_argument('--max_num_lines', type=int, help='Maximum number of lines to process.')
-    parser.add_argument('--only_embedding_model', action='store_true', help='Use only the embedding model to calculate semantic distance.')
+    parser.add_argument('--only_embedding_model', action='store_true', help='Use only the embedding model to calculate semantic distance, skipping the number check.')
+    parser.add_argument('--only_number_check', action='store_true', help='Only run the number check, without loading the embedding model. Use with --drop_number_mismatch as a cheap pre-filter; the output can be given back as --input_file for the embedding step.')
+    parser.add_argument('--drop_number_mismatch', action='store_true', help='Drop pairs with mismatched numbers before embedding instead of only flagging them.')
     parser.add_argument('--max_distance_score', type=float, default=1.0, help='Maximum distance score to include in the output.')
-    parser.add_argument('--batch_size', type=int, default=512, help='Batch size for processing.')
+    parser.add_argument('--batch_size', type=int, default=512, help='Batch size for the embedding model.')
+    parser.add_argument('--window_size', type=int, default=50000, help='Number of lines read and length-sorted at a time.')
+    parser.add_argument('--embedding_cache', type=str, help='Directory of a persistent embedding cache. Only sentences not already in it are embedded.')
+    parser.add_argument('--num_workers', type=int, default=1, help='Number of CPU embedding worker processes.')
+    parser.add_argument('--threads_per_worker', type=int, help='Threads per worker process. Defaults to the cores divided by --num_workers.')
+    parser.add_argument('--backend', type=str, choices=['torch', 'onnx'], default='torch', help='Inference backend for the embedding model.')
+    parser.add_argument('--quantize', type=str, choices=['int8'], help='Dynamically quantise the model (torch backend, CPU only).')
     
     args = parser.parse_args()
+    if args.quantize and args.backend != 'torch':
+        parser.error('--quantize is only supported with --backend torch.')
+    if args.only_number_check and args.only_embedding_model:
+        parser.error('--only_number_check and --only_embedding_model are mutually exclusive.')
+    
+    entries = read_parallel_corpus(args.input_file, args.max_num_lines)
+    check_numbers = not args.only_embedding_model
+    if args.only_number_check:
+        process_in_windows(entries, None, args.window_size, check_numbers, args.drop_number_mismatch, args.max_distance_score, args.output_file)
+        return
     
-    device = "cuda" if torch.cuda.is_available() else "cpu"
-    model = SentenceTransformer('sentence-transformers/LaBSE', device=device)
+    # The cache is keyed by model, so quantised or ONNX embeddings never mix with fp32 ones.
+    cache_model_name = MODEL_NAME if args.backend == 'torch' and not args.quantize else f"{MODEL_NAME}:{args.backend}:{args.quantize or 'fp32'}"
+    cache = EmbeddingCache(args.embedding_cache, cache_model_name) if args.embedding_cache else None
     
-    data = read_parallel_corpus(args.input_file, args.max_num_lines)
-    process_in_batches(data, model, args.batch_size, args.only_embedding_model, args.max_distance_score, args.output_file, device)
+    try:
+        with sentence_encoder(MODEL_NAME, args.batch_size, args.backend, args.quantize,
+                              args.num_workers, args.threads_per_worker) as encode_fn:
+            embed = functools.partial(embed_sentences, encode_fn=encode_fn, cache=cache)
+            process_in_windows(entries, embed, args.window_size, check_numbers, args.drop_number_mismatch, args.max_distance_score, args.output_file)
+    finally:
+        if cache is not None:
+            cache.close()
+    if cache is not None:
+        print(f"Embedding cache {args.embedding_cache} holds {len(cache)} sentences.")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+"""
+Chat template transcoding between sharegpt `conversations`, Llama3 and Gemma2.
+
+Each format is parsed once into a list of Turn objects (a Role enum plus a
+slice into the source string) and any target format is rendered from that
+list, so converting one prompt to several formats costs a single parse.
+Adding a template means adding a parser and/or renderer to PARSERS/RENDERERS.
+"""
+
+from collections import namedtuple
+from enum import IntEnum
+
+from template_validators import (
+    BEGIN_OF_TEXT, END_OF_TEXT, START_HEADER, END_HEADER, EOT,
+    START_OF_TURN, END_OF_TURN,
+)
+
+class Role(IntEnum):
+    SYSTEM = 0
+    USER = 1
+    ASSISTANT = 2
+    OTHER = 3  # Unknown role names; renderers skip these.
+
+class Turn(namedtuple("Turn", ["role", "source", "start", "end"])):
+    """A message: its role and the [start, end) slice of source holding its text."""
+    __slots__ = ()
+
+    @property
+    def text(self):
+        return self.source[self.start:self.end]
+
+LLAMA3_ROLES = {"system": Role.SYSTEM, "user": Role.USER, "assistant": Role.ASSISTANT}
+GEMMA2_ROLES = {"user": Role.USER, "model": Role.ASSISTANT}
+# Anything that is not human/gpt is treated as a user message, as convert_instructions_to_llama3.py always did.
+SHAREGPT_ROLES = {"human": Role.USER, "gpt": Role.ASSISTANT}
+
+LLAMA3_ROLE_NAMES = {Role.SYSTEM: "system", Role.USER: "user", Role.ASSISTANT: "assistant"}
+GEMMA2_ROLE_NAMES = {Role.USER: "user", Role.ASSISTANT: "model"}
+SHAREGPT_ROLE_NAMES = {Role.SYSTEM: "system", Role.USER: "human", Role.ASSISTANT: "gpt"}
+
+def _strip_span(text, start, end):
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return start, end
+
+def iter_llama3_turns(prompt, pos=0, strict_roles=False):
+    """
+    Yields (turn, block_end) for every
+    '<|start_header_id|>role<|end_header_id|>message<|eot_id|>' block from pos
+    onwards, where block_end is the offset just past the block's <|eot_id|>.
+
+    The role is matched case-insensitively with surrounding whitespace
+    ignored; with strict_roles the role must be exactly system, user or
+    assistant, and other headers are skipped. Message text is stripped.
+    """
+    while True:
+        header = prompt.find(START_HEADER, pos)
+        if header == -1:
+            return
+        role_start = header + len(START_HEADER)
+        header_end = prompt.find(END_HEADER, role_start)
+        if header_end == -1:
+            return
+        role_name = prompt[role_start:header_end]
+        if strict_roles:
+            role = LLAMA3_ROLES.get(role_name)
+            if role is None:
+                pos = header + 1
+                continue
+        else:
+            role = LLAMA3_ROLES.get(role_name.strip().lower(), Role.OTHER)
+        content_start = header_end + len(END_HEADER)
+        eot = prompt.find(EOT, content_start)
+        if eot == -1:
+            return
+        start, end = _strip_span(prompt, content_start, eot)
+        pos = eot + len(EOT)
+        yield Turn(role, prompt, start, end), pos
+
+def parse_llama3(prompt, strict_roles=False):
+    return [turn for turn, _ in iter_llama3_turns(prompt, strict_roles=strict_roles)]
+
+def parse_gemma2(prompt):
+    turns = []
+    pos = 0
+    while True:
+        header = prompt.find(START_OF_TURN, pos)
+        if header == -1:
+            return turns
+        role_start = header + len(START_OF_TURN)
+        role_end = prompt.find("\n", role_start)
+        if role_end == -1:
+            return turns
+        end_of_turn = prompt.find(END_OF_TURN, role_end + 1)
+        if end_of_turn == -1:
+            return turns
+        role = GEMMA2_ROLES.get(prompt[role_start:role_end].strip(), Role.OTHER)
+        start, end = _strip_span(prompt, role_end + 1, end_of_turn)
+        turns.append(Turn(role, prompt, start, end))
+        pos = end_of_turn + len(END_OF_TURN)
+
+def parse_sharegpt(conversation):
+    return [
+        Turn(SHAREGPT_ROLES.get(message["from"], Role.USER), message["value"], 0, len(message["value"]))
+        for message in conversation
+    ]
+
+def render_llama3(turns):
+    parts = [BEGIN_OF_TEXT, "\n"]
+    for turn in turns:
+        name = LLAMA3_ROLE_NAMES.get(turn.role)
+        if name is None:
+            continue
+        parts.append(f"{START_HEADER}{name}{END_HEADER}\n{turn.text}{EOT}\n")
+    parts.append(END_OF_TEXT)
+    return "".join(parts)
+
+def render_gemma2(turns):
+    """Gemma2 has no system role, so system turns are dropped."""
+    lines = []
+    for turn in turns:
+        name = GEMMA2_ROLE_NAMES.get(turn.role)
+        if name is None:
+            continue
+        lines.append(f"{START_OF_TURN}{name}")
+        lines.append(turn.text)
+        lines.append(END_OF_TURN)
+    return "\n".join(lines)
+
+def render_sharegpt(turns):
+    return [
+        {"from": SHAREGPT_ROLE_NAMES[turn.role], "value": turn.text}
+        for turn in turns if turn.role in SHAREGPT_ROLE_NAMES
+    ]
+
+PARSERS = {
+    "llama3": parse_llama3,
+    "gemma2": parse_gemma2,
+    "sharegpt": parse_sharegpt,
+}
+
+RENDERERS = {
+    "llama3": render_llama3,
+    "gemma2": render_gemma2,
+    "sharegpt": render_sharegpt,
+}
+
+def transcode(data, source_format, target_format):
+    """Converts a prompt (or sharegpt conversation) from one template to another."""
+    return RENDERERS[target_format](PARSERS[source_format](data))
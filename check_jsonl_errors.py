@@ -1,10 +1,11 @@
 import argparse
 import json
-import os
+
+from corpus_io import list_jsonl_files, open_text
 
 def check_jsonl_file(filepath):
     error_log = []
-    with open(filepath, 'r') as file:
+    with open_text(filepath) as file:
         for i, line in enumerate(file, 1):
             try:
                 record = json.loads(line)
@@ -24,10 +25,8 @@ def check_jsonl_file(filepath):
             print(f"Row {row}: {error}")
 
 def check_jsonl_files(directory):
-    for filename in os.listdir(directory):
-        if filename.endswith(".jsonl"):
-            filepath = os.path.join(directory, filename)
-            check_jsonl_file(filepath)
+    for filepath in list_jsonl_files(directory):
+        check_jsonl_file(filepath)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Check JSONL files for inconsistent data types in the 'text' column.")
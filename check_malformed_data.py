@@ -4,16 +4,40 @@ import argparse
 import json
 import glob
 import os
+import shutil
+import tempfile
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 import ftfy  # Make sure ftfy is installed: pip install ftfy
 
+from corpus_io import COMPRESSION_SUFFIXES, open_text
+
 def check_and_fix_file(filename, max_text_length, fix):
+    """
+    Checks a single JSONL file and, with fix=True, streams the good lines to a
+    temporary file next to the input that is atomically renamed over it.
+    Returns a report dict with line totals and anomaly counts per category.
+    """
     anomalies = 0
     total_lines = 0
-    good_lines = []  # store valid (and possibly fixed) lines when fixing
+    kept_lines = 0
+    categories = Counter()
     print(f"Processing file: {filename}")
 
+    tmp_path = None
+    f_out = None
     try:
-        with open(filename, "r", encoding="utf-8") as f:
+        if fix:
+            # Keep the temp file on the same filesystem so os.replace() is atomic,
+            # and keep the compression suffix so it is written in the same format.
+            compression = next((s for s in COMPRESSION_SUFFIXES if filename.endswith(s)), "")
+            fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(filename)}.",
+                                            suffix=".tmp" + compression,
+                                            dir=os.path.dirname(os.path.abspath(filename)))
+            os.close(fd)
+            f_out = open_text(tmp_path, "w")
+
+        with open_text(filename) as f:
             for idx, line in enumerate(f, start=1):
                 total_lines += 1
                 original_line = line
@@ -22,7 +46,8 @@ def check_and_fix_file(filename, max_text_length, fix):
 
                 # Check if the entire line is empty.
                 if not stripped:
-                    print(f"  Line {idx}: Empty line.")
+                    print(f"  {filename} line {idx}: Empty line.")
+                    categories["empty_line"] += 1
                     anomalies += 1
                     error_found = True
                 else:
@@ -30,11 +55,13 @@ def check_and_fix_file(filename, max_text_length, fix):
                     if "�" in stripped:
                         fixed_text = ftfy.fix_text(stripped)
                         if "�" in fixed_text:
-                            print(f"  Line {idx}: Encoding issue detected (replacement character found) and ftfy could not fix it.")
+                            print(f"  {filename} line {idx}: Encoding issue detected (replacement character found) and ftfy could not fix it.")
+                            categories["encoding_unfixable"] += 1
                             anomalies += 1
                             error_found = True
                         else:
-                            print(f"  Line {idx}: Encoding issue detected but ftfy fixed it.")
+                            print(f"  {filename} line {idx}: Encoding issue detected but ftfy fixed it.")
+                            categories["encoding_fixed"] += 1
                             stripped = fixed_text
                             # If in fix mode, update the original line as well.
                             original_line = fixed_text + "\n"
@@ -43,38 +70,66 @@ def check_and_fix_file(filename, max_text_length, fix):
                     try:
                         data = json.loads(stripped)
                     except json.JSONDecodeError as e:
-                        print(f"  Line {idx}: JSON parse error -> {e}")
+                        print(f"  {filename} line {idx}: JSON parse error -> {e}")
+                        categories["json_error"] += 1
                         anomalies += 1
                         error_found = True
                     else:
-                        # Check that no string field is empty and that no field exceeds max_text_length.
-                        for k, v in data.items():
-                            if isinstance(v, str):
-                                if v.strip() == "":
-                                    print(f"  Line {idx}: Field '{k}' is empty.")
-                                    anomalies += 1
-                                    error_found = True
-                                    break
-                                if len(v) > max_text_length:
-                                    print(f"  Line {idx}: Field '{k}' has {len(v)} characters, exceeds {max_text_length} chars.")
-                                    anomalies += 1
-                                    error_found = True
-                                    break
-
-                if fix:
-                    if not error_found:
-                        good_lines.append(original_line)
+                        if not isinstance(data, dict):
+                            print(f"  {filename} line {idx}: Line is not a JSON object.")
+                            categories["json_error"] += 1
+                            anomalies += 1
+                            error_found = True
+                        else:
+                            # Check that no string field is empty and that no field exceeds max_text_length.
+                            for k, v in data.items():
+                                if isinstance(v, str):
+                                    if v.strip() == "":
+                                        print(f"  {filename} line {idx}: Field '{k}' is empty.")
+                                        categories["empty_field"] += 1
+                                        anomalies += 1
+                                        error_found = True
+                                        break
+                                    if len(v) > max_text_length:
+                                        print(f"  {filename} line {idx}: Field '{k}' has {len(v)} characters, exceeds {max_text_length} chars.")
+                                        categories["too_long"] += 1
+                                        anomalies += 1
+                                        error_found = True
+                                        break
+
+                if fix and not error_found:
+                    f_out.write(original_line)
+                    kept_lines += 1
                 # In non-fix mode, we simply report anomalies.
         if fix:
-            with open(filename, "w", encoding="utf-8") as f_out:
-                f_out.writelines(good_lines)
-            print(f"Finished fixing {filename}. Removed {total_lines - len(good_lines)} bad lines.")
+            # Closing writes what a compressor still buffers and its frame end, so sync after it
+            f_out.close()
+            with open(tmp_path, "rb") as f:
+                os.fsync(f.fileno())
+            # mkstemp creates the file as 0600; keep the input's permissions
+            shutil.copymode(filename, tmp_path)
+            os.replace(tmp_path, filename)
+            tmp_path = None
+            print(f"Finished fixing {filename}. Removed {total_lines - kept_lines} bad lines.")
         else:
             print(f"Finished checking {filename}. Found {anomalies} anomalies in {total_lines} lines.\n")
-        return anomalies, total_lines
+        return {
+            "file": filename,
+            "total_lines": total_lines,
+            "anomalies": anomalies,
+            "removed_lines": total_lines - kept_lines if fix else 0,
+            "categories": dict(categories),
+        }
     except OSError as e:
         print(f"Error opening file {filename}: {e}")
-        return 0, 0
+        return {"file": filename, "total_lines": 0, "anomalies": 0, "removed_lines": 0,
+                "categories": {}, "error": str(e)}
+    finally:
+        # Never leave a half-written temp file behind; the input is untouched.
+        if f_out is not None and not f_out.closed:
+            f_out.close()
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.remove(tmp_path)
 
 def main():
     parser = argparse.ArgumentParser(
@@ -86,7 +141,12 @@ def main():
     parser.add_argument("--max_text_length", type=int, default=10000,
                         help="Threshold for flagging overly long text fields.")
     parser.add_argument("--fix", action="store_true",
-                        help="If set, remove lines with errors (no backup is created).")
+                        help="If set, remove lines with errors (no backup is created). "
+                             "Files are rewritten through a temp file and atomically renamed.")
+    parser.add_argument("--max_cpu_count", type=int, default=48,
+                        help="Maximum number of files processed concurrently.")
+    parser.add_argument("--report_file", type=str,
+                        help="Write a JSON report with anomaly counts per file and category to this path.")
     args = parser.parse_args()
 
     # Expand each input pattern into a list of files.
@@ -102,16 +162,36 @@ def main():
         print("No files found for the provided pattern(s).")
         return
 
-    total_anomalies = 0
-    total_lines_processed = 0
+    num_workers = max(1, min(os.cpu_count(), args.max_cpu_count, len(all_files)))
 
-    for file in all_files:
-        anomalies, lines = check_and_fix_file(file, args.max_text_length, args.fix)
-        total_anomalies += anomalies
-        total_lines_processed += lines
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        reports = list(executor.map(check_and_fix_file, all_files,
+                                    [args.max_text_length] * len(all_files),
+                                    [args.fix] * len(all_files)))
+
+    total_anomalies = sum(r["anomalies"] for r in reports)
+    total_lines_processed = sum(r["total_lines"] for r in reports)
+    total_categories = Counter()
+    for r in reports:
+        total_categories.update(r["categories"])
 
     print(f"\nOverall summary: Processed {len(all_files)} files, {total_lines_processed} lines total. "
           f"Found {total_anomalies} anomalies overall.")
 
+    if args.report_file:
+        report = {
+            "files": reports,
+            "totals": {
+                "files": len(all_files),
+                "total_lines": total_lines_processed,
+                "anomalies": total_anomalies,
+                "removed_lines": sum(r["removed_lines"] for r in reports),
+                "categories": dict(total_categories),
+            },
+        }
+        with open(args.report_file, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report saved to {args.report_file}")
+
 if __name__ == "__main__":
     main()
@@ -1,18 +1,24 @@
 import json
 import argparse
 
+from corpus_io import open_text
+
+def concatenate_record(record):
+    """Replaces the paragraphs of a decoded record with their texts joined by newlines."""
+    # Ensure id is a string
+    record['id'] = str(record['id'])
+    # Concatenate text from paragraphs
+    concatenated_text = "\n".join(paragraph['text'] for paragraph in record.get('paragraphs', []))
+    # Replace paragraphs with the concatenated text
+    record['text'] = concatenated_text
+    # Remove paragraphs field
+    record.pop('paragraphs', None)
+    return record
+
 def process_file(input_file, output_file):
-    with open(input_file, 'r', encoding='utf-8') as infile, open(output_file, 'w', encoding='utf-8') as outfile:
+    with open_text(input_file) as infile, open_text(output_file, 'w') as outfile:
         for line in infile:
-            record = json.loads(line)
-            # Ensure id is a string
-            record['id'] = str(record['id'])
-            # Concatenate text from paragraphs
-            concatenated_text = "\n".join(paragraph['text'] for paragraph in record.get('paragraphs', []))
-            # Replace paragraphs with the concatenated text
-            record['text'] = concatenated_text
-            # Remove paragraphs field
-            record.pop('paragraphs', None)
+            record = concatenate_record(json.loads(line))
             # Write the processed record to the output file
             json.dump(record, outfile)
             outfile.write('\n')
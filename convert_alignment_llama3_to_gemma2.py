@@ -1,84 +1,151 @@
 #!/usr/bin/env python
-import re
+import os
 import json
 import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from corpus_io import open_text
+from chat_templates import iter_llama3_turns, parse_llama3, render_gemma2
+from template_validators import validate_gemma2_relaxed, validate_llama3_wrapped
 
 def validate_llama3(prompt):
     """Updated validation with better error messages"""
-    if not re.match(r"^<\|begin_of_text\|>(\s*<\|start_header_id\|>.+?<\|end_header_id\|>.+?<\|eot_id\|>\s*)+<\|end_of_text\|>$", prompt, re.DOTALL):
-        raise ValueError("Invalid Llama3 structure")
+    is_valid, message, position = validate_llama3_wrapped(prompt)
+    if not is_valid:
+        raise ValueError(f"Invalid Llama3 structure at offset {position}: {message}")
 
 def validate_gemma2(prompt):
     """Relaxed validation focusing on essential structure"""
-    if not re.match(r"^(<start_of_turn>(user|model)\n.*?\n<end_of_turn>\s*)+$", prompt, re.DOTALL):
-        raise ValueError("Invalid Gemma2 structure")
+    is_valid, message, position = validate_gemma2_relaxed(prompt)
+    if not is_valid:
+        raise ValueError(f"Invalid Gemma2 structure at offset {position}: {message}")
 
 def convert_llama3_to_gemma2(prompt):
     """Conversion with essential checks only"""
+    if not isinstance(prompt, str):
+        raise ValueError(f"Conversion failed: expected a string, got {type(prompt).__name__}")
+    # Only exact user/assistant/system headers count as turns; system turns are dropped.
+    return render_gemma2(parse_llama3(prompt, strict_roles=True))
+
+def _join_rendered(shared, rest):
+    # render_gemma2 joins lines with "\n", so two rendered runs of turns concatenate the same way.
+    if shared and rest:
+        return shared + "\n" + rest
+    return shared or rest
+
+def convert_pair(chosen, rejected):
+    """
+    Converts a chosen/rejected pair, parsing and rendering the turns of their
+    shared prompt prefix only once. The result is identical to converting each
+    field on its own.
+    """
+    if not (isinstance(chosen, str) and isinstance(rejected, str)):
+        return convert_llama3_to_gemma2(chosen), convert_llama3_to_gemma2(rejected)
+
+    # A turn that ends inside the common prefix parses identically in both strings.
+    shared_length = len(os.path.commonprefix([chosen, rejected]))
+    shared_turns = []
+    chosen_turns = []
+    pos = 0
+    for turn, block_end in iter_llama3_turns(chosen, strict_roles=True):
+        if block_end <= shared_length and not chosen_turns:
+            shared_turns.append(turn)
+            pos = block_end
+        else:
+            chosen_turns.append(turn)
+    rejected_turns = [turn for turn, _ in iter_llama3_turns(rejected, pos, strict_roles=True)]
+
+    shared = render_gemma2(shared_turns)
+    return (_join_rendered(shared, render_gemma2(chosen_turns)),
+            _join_rendered(shared, render_gemma2(rejected_turns)))
+
+def convert_record(line):
+    """
+    Converts one JSONL line. Returns (output_line, errors) where output_line is
+    None when the record is dropped and errors is a list of (field, message),
+    with field None for invalid JSON.
+    """
     try:
-        # Remove BOS/EOS tokens
-        clean_prompt = re.sub(r"^<\|begin_of_text\|>\s*|\s*<\|end_of_text\|>$", "", prompt, flags=re.DOTALL)
-        
-        # Extract message pairs
-        blocks = re.findall(
-            r"<\|start_header_id\|>(user|assistant|system)<\|end_header_id\|>\s*([\s\S]*?)\s*<\|eot_id\|>",
-            clean_prompt
-        )
-        
-        output = []
-        for role, content in blocks:
-            role = role.strip().lower()
-            content = content.strip()
-            
-            if role == "system":
-                continue
-                
-            output.append(f"<start_of_turn>{'user' if role == 'user' else 'model'}")
-            output.append(content)
-            output.append("<end_of_turn>")
-        
-        return "\n".join(output)
-    
-    except Exception as e:
-        raise ValueError(f"Conversion failed: {str(e)}")
+        data = json.loads(line)
+    except json.JSONDecodeError:
+        return None, [(None, "invalid JSON")]
+
+    fields = [field for field in ['chosen', 'rejected'] if field in data]
+    converted = {}
+    if len(fields) == 2:
+        try:
+            converted['chosen'], converted['rejected'] = convert_pair(data['chosen'], data['rejected'])
+        except Exception:
+            # Fall back to field by field so each failure is reported as before.
+            converted = {}
 
-def process_file(input_file, output_file):
+    errors = []
+    # Process both fields
+    for field in fields:
+        try:
+            # Convert and validate
+            value = converted[field] if field in converted else convert_llama3_to_gemma2(data[field])
+            validate_gemma2(value)
+            data[field] = value
+        except Exception as e:
+            errors.append((field, str(e)))
+
+    # Only write if both fields are valid
+    if errors:
+        return None, errors
+    return json.dumps(data, ensure_ascii=False) + "\n", errors
+
+def convert_chunk(lines):
+    return [convert_record(line) for line in lines]
+
+def read_in_chunks(file_object, chunk_size=1000):
+    """Lazy function (generator) to read a file piece by piece."""
+    chunk = []
+    for line in file_object:
+        chunk.append(line)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def process_file(input_file, output_file, max_cpu_count=48, chunk_size=1000):
     """Process files with strict validation and proper filtering"""
-    with open(input_file, "r", encoding="utf-8") as infile, \
-         open(output_file, "w", encoding="utf-8") as outfile:
+    num_cores = max(1, min(os.cpu_count(), max_cpu_count))
+
+    with open_text(input_file) as infile, \
+         open_text(output_file, "w") as outfile, \
+         ProcessPoolExecutor(max_workers=num_cores) as executor:
         
         total = 0
         kept = 0
         errors = 0
         
-        for line in infile:
-            total += 1
-            try:
-                data = json.loads(line)
-                valid = True
-                
-                # Process both fields
-                for field in ['chosen', 'rejected']:
-                    if field in data:
-                        try:
-                            # Convert and validate
-                            converted = convert_llama3_to_gemma2(data[field])
-                            validate_gemma2(converted)
-                            data[field] = converted
-                        except Exception as e:
-                            print(f"Skipping {field} in line {total}: {str(e)}")
-                            valid = False
-                
-                # Only write if both fields are valid
-                if valid:
-                    outfile.write(json.dumps(data, ensure_ascii=False) + "\n")
-                    kept += 1
-                else:
+        def write_results(results):
+            nonlocal total, kept, errors
+            for output, line_errors in results:
+                total += 1
+                for field, message in line_errors:
+                    if field is None:
+                        print(f"Skipping invalid JSON at line {total}")
+                    else:
+                        print(f"Skipping {field} in line {total}: {message}")
+                if output is None:
                     errors += 1
-                    
-            except json.JSONDecodeError:
-                print(f"Skipping invalid JSON at line {total}")
-                errors += 1
+                else:
+                    outfile.write(output)
+                    kept += 1
+
+        # Keep a bounded number of chunks in flight and consume them in order,
+        # so the output keeps the input order without reading the whole file.
+        pending = deque()
+        for chunk in read_in_chunks(infile, chunk_size):
+            pending.append(executor.submit(convert_chunk, chunk))
+            if len(pending) >= num_cores * 2:
+                write_results(pending.popleft().result())
+        while pending:
+            write_results(pending.popleft().result())
         
         print(f"\nProcessing complete:")
         print(f"- Total entries: {total}")
@@ -89,5 +156,6 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--input_file", required=True)
     parser.add_argument("--output_file", required=True)
+    parser.add_argument("--max_cpu_count", type=int, default=48, help="Maximum number of CPU cores to use.")
     args = parser.parse_args()
-    process_file(args.input_file, args.output_file)
+    process_file(args.input_file, args.output_file, args.max_cpu_count)
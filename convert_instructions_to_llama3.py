@@ -1,23 +1,18 @@
 import json
 import argparse
 
+from corpus_io import base_name, open_text
+from chat_templates import parse_sharegpt, render_llama3
+
 def convert_to_llama3_format(conversation, input_file_name, index):
-    prompt = "<|begin_of_text|>\n"
-    role_map = {"human": "user", "gpt": "assistant"}
-    
-    for message in conversation:
-        role = role_map.get(message["from"], "user")
-        prompt += f"<|start_header_id|>{role}<|end_header_id|>\n{message['value']}<|eot_id|>\n"
-    
-    prompt += "<|end_of_text|>"
     return {
         "id": f"{input_file_name}_{index}",
-        "text": prompt
+        "text": render_llama3(parse_sharegpt(conversation))
     }
 
 def process_file(input_file, output_file):
-    input_file_name = input_file.split('/')[-1].replace('.jsonl', '')
-    with open(input_file, 'r') as infile, open(output_file, 'w') as outfile:
+    input_file_name = base_name(input_file)
+    with open_text(input_file) as infile, open_text(output_file, 'w') as outfile:
         for index, line in enumerate(infile):
             data = json.loads(line)
             formatted_data = convert_to_llama3_format(data["conversations"], input_file_name, index + 1)
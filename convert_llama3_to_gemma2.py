@@ -1,8 +1,10 @@
 #!/usr/bin/env python
-import re
 import json
 import argparse
 
+from corpus_io import open_text
+from chat_templates import BEGIN_OF_TEXT, END_OF_TEXT, parse_llama3, render_gemma2
+
 def convert_llama3_to_gemma2(prompt):
     """
     Converts a Llama3-formatted prompt to a Gemma2-formatted prompt.
@@ -23,49 +25,19 @@ def convert_llama3_to_gemma2(prompt):
       
     System messages are ignored.
     """
-    begin_token = "<|begin_of_text|>"
-    end_token = "<|end_of_text|>"
-    
-    if not (prompt.startswith(begin_token) and prompt.endswith(end_token)):
+    if not (prompt.startswith(BEGIN_OF_TEXT) and prompt.endswith(END_OF_TEXT)):
         raise ValueError("Prompt does not have proper Llama3 wrapping tokens.")
     
-    # Extract inner content
-    inner = prompt[len(begin_token):-len(end_token)].strip()
-    
-    # Regex to extract each block:
-    # Matches: <|start_header_id|>role<|end_header_id|> followed by message text until <|eot_id|>
-    pattern = r"<\|start_header_id\|>(.*?)<\|end_header_id\|>\s*(.*?)\s*<\|eot_id\|>"
-    blocks = re.findall(pattern, inner, re.DOTALL)
-    
-    gemma2_lines = []
-    for role, message in blocks:
-        role = role.strip().lower()
-        message = message.strip()
-        if role == "system":
-            # Optionally ignore system messages.
-            continue
-        elif role == "user":
-            gemma2_role = "user"
-        elif role == "assistant":
-            gemma2_role = "model"
-        else:
-            # Skip unknown roles.
-            continue
-        gemma2_lines.append(f"<start_of_turn>{gemma2_role}")
-        gemma2_lines.append(message)
-        gemma2_lines.append("<end_of_turn>")
-    
-    # Join the blocks with newlines.
-    gemma2_prompt = "\n".join(gemma2_lines)
-    return gemma2_prompt
+    # Roles are matched case-insensitively; unknown roles are skipped by the renderer.
+    return render_gemma2(parse_llama3(prompt))
 
 def process_file(input_file, output_file):
     """
     Reads a JSONL file with Llama3 prompts (in the "text" field),
     converts each to Gemma2 format, and writes them to an output JSONL file.
     """
-    with open(input_file, "r", encoding="utf-8") as infile, \
-         open(output_file, "w", encoding="utf-8") as outfile:
+    with open_text(input_file) as infile, \
+         open_text(output_file, "w") as outfile:
         for line in infile:
             try:
                 data = json.loads(line)
@@ -0,0 +1,339 @@
+#!/usr/bin/env python
+"""
+Shared readers and writers for corpus files in JSONL or Parquet.
+
+open_text opens plain, gzip (.gz) or zstd (.zst) text files based on the
+suffix. Compressed input is decompressed on a background thread that stays
+a few chunks ahead of the consumer. .zst output is compressed on multiple
+threads. zstandard is only imported when a .zst file is opened.
+recover_appendable repairs what a killed writer leaves at the end of a
+file before a resumed run appends to it.
+
+Parquet corpora are written with zstd compression and row groups small
+enough to stream, with the text stored as large_string and ids, scores and
+doc_type as native columns. Readers can project just the columns they need:
+for Parquet only those column chunks are read from disk, and for JSONL the
+other keys are dropped after decoding.
+"""
+
+import glob
+import gzip
+import io
+import json
+import os
+import queue
+import threading
+import zlib
+
+PARQUET_SUFFIXES = (".parquet", ".pq")
+COMPRESSION_SUFFIXES = (".gz", ".zst")
+JSONL_PATTERNS = ("*.jsonl", "*.jsonl.gz", "*.jsonl.zst")
+DEFAULT_ROW_GROUP_SIZE = 50000
+READ_CHUNK_SIZE = 1 << 20
+READ_AHEAD_CHUNKS = 16
+
+def is_parquet(path):
+    return path.endswith(PARQUET_SUFFIXES)
+
+def base_name(path):
+    """File name without directory, compression suffix or extension: corpus/a.jsonl.zst -> a."""
+    name = os.path.basename(path)
+    if name.endswith(COMPRESSION_SUFFIXES):
+        name = os.path.splitext(name)[0]
+    return os.path.splitext(name)[0]
+
+def list_jsonl_files(directory):
+    """Sorted plain and compressed JSONL files in a directory."""
+    return sorted(f for pattern in JSONL_PATTERNS for f in glob.glob(os.path.join(directory, pattern)))
+
+class _ThreadedReader(io.RawIOBase):
+    """Reads a binary stream on a background thread, up to READ_AHEAD_CHUNKS chunks ahead of the consumer."""
+
+    def __init__(self, raw):
+        self._raw = raw
+        self._queue = queue.Queue(READ_AHEAD_CHUNKS)
+        self._stop = threading.Event()
+        self._chunk = memoryview(b"")
+        self._eof = False
+        self._thread = threading.Thread(target=self._fill, daemon=True)
+        self._thread.start()
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _fill(self):
+        try:
+            while True:
+                # gzip and zstandard release the GIL while decompressing, so this overlaps with parsing
+                data = self._raw.read(READ_CHUNK_SIZE)
+                if not self._put(data) or not data:
+                    return
+        except Exception as e:
+            self._put(e)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if not len(self._chunk):
+            if self._eof:
+                return 0
+            item = self._queue.get()
+            if isinstance(item, Exception):
+                self._eof = True
+                raise item
+            if not item:
+                self._eof = True
+                return 0
+            self._chunk = memoryview(item)
+        n = min(len(buffer), len(self._chunk))
+        buffer[:n] = self._chunk[:n]
+        self._chunk = self._chunk[n:]
+        return n
+
+    def close(self):
+        if not self.closed:
+            self._stop.set()
+            self._thread.join()
+            self._raw.close()
+        super().close()
+
+def open_text(path, mode="r", encoding="utf-8", compression_level=3, threads=-1):
+    """
+    Opens a text file for reading ("r"), writing ("w") or appending ("a"),
+    compressed according to its suffix. Appending to a .zst or .gz file adds
+    a new frame or member, which the readers here decode transparently. Call
+    recover_appendable before appending to a file a killed run may have left.
+    threads is the number of zstd compression threads (-1: one per core).
+    """
+    if mode not in ("r", "w", "a"):
+        raise ValueError(f"Unsupported mode {mode!r}")
+    if path.endswith(".zst"):
+        import zstandard
+        if mode == "r":
+            raw = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), read_across_frames=True, closefd=True)
+            return io.TextIOWrapper(io.BufferedReader(_ThreadedReader(raw), READ_CHUNK_SIZE), encoding=encoding)
+        compressor = zstandard.ZstdCompressor(level=compression_level, threads=threads)
+        writer = compressor.stream_writer(open(path, mode + "b"), closefd=True, write_return_read=True)
+        return io.TextIOWrapper(io.BufferedWriter(writer, READ_CHUNK_SIZE), encoding=encoding)
+    if path.endswith(".gz"):
+        if mode == "r":
+            return io.TextIOWrapper(io.BufferedReader(_ThreadedReader(gzip.open(path, "rb")), READ_CHUNK_SIZE), encoding=encoding)
+        return gzip.open(path, mode + "t", encoding=encoding)
+    return open(path, mode, encoding=encoding)
+
+def sync_text(f):
+    """
+    Flushes a file opened for writing by open_text through its compressor and
+    fsyncs it, so the lines written so far survive the process being killed.
+    """
+    f.flush()
+    # The zstd writer only emits what it has buffered when flushed itself
+    raw = getattr(f.buffer, "raw", None)
+    if raw is not None:
+        raw.flush()
+    os.fsync(f.fileno())
+
+def _decompressor_factory(path):
+    if path.endswith(".zst"):
+        import zstandard
+        return lambda: zstandard.ZstdDecompressor().decompressobj()
+    return lambda: zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+def _scan_compressed(path, consume):
+    """
+    Decompresses a .zst or .gz file frame by frame (member by member), passing
+    the data to consume. Returns False if the file ends inside a frame, as it
+    does after the writer was killed.
+    """
+    new_decompressor = _decompressor_factory(path)
+    decompressor = new_decompressor()
+    in_frame = False
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            while chunk:
+                data = decompressor.decompress(chunk)
+                if data:
+                    consume(data)
+                if decompressor.eof:
+                    chunk = decompressor.unused_data
+                    decompressor = new_decompressor()
+                    in_frame = False
+                else:
+                    chunk = b""
+                    in_frame = True
+    return not in_frame
+
+def recover_appendable(path, compression_level=3, max_lines=None):
+    """
+    Prepares a text file for appending after a run that may have been killed
+    and returns its number of complete lines. An incomplete last line is
+    removed, and so is an unfinished .zst frame or .gz member, which would
+    otherwise corrupt everything appended after it. With max_lines, lines
+    beyond the first max_lines are removed as well. A plain file is
+    truncated; a damaged compressed file is rewritten with its complete lines.
+    """
+    if not os.path.exists(path):
+        return 0
+    state = {"lines": 0, "end": 0, "position": 0}
+
+    def count(data):
+        newlines = data.count(b"\n")
+        if max_lines is not None and state["lines"] + newlines > max_lines:
+            last = -1
+            for _ in range(max_lines - state["lines"]):
+                last = data.index(b"\n", last + 1)
+            newlines = max_lines - state["lines"]
+        else:
+            last = data.rfind(b"\n")
+        state["lines"] += newlines
+        if newlines:
+            state["end"] = state["position"] + last + 1
+        state["position"] += len(data)
+
+    if not path.endswith(COMPRESSION_SUFFIXES):
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(READ_CHUNK_SIZE), b""):
+                count(chunk)
+        if state["position"] > state["end"]:
+            os.truncate(path, state["end"])
+        return state["lines"]
+
+    complete = _scan_compressed(path, count)
+    if complete and state["position"] == state["end"]:
+        return state["lines"]
+
+    # Rewrite the complete lines into a fresh file, keeping the compression suffix last
+    root, suffix = os.path.splitext(path)
+    tmp_path = root + ".tmp" + suffix
+    if suffix == ".zst":
+        import zstandard
+        raw = open(tmp_path, "wb")
+        writer = zstandard.ZstdCompressor(level=compression_level, threads=-1).stream_writer(raw, closefd=False)
+    else:
+        raw = open(tmp_path, "wb")
+        writer = gzip.GzipFile(fileobj=raw, mode="wb")
+    remaining = [state["end"]]
+
+    def copy(data):
+        data = data[:remaining[0]]
+        remaining[0] -= len(data)
+        if data:
+            writer.write(data)
+
+    try:
+        _scan_compressed(path, copy)
+        writer.close()
+        raw.flush()
+        os.fsync(raw.fileno())
+    finally:
+        raw.close()
+    os.replace(tmp_path, path)
+    print(f"Recovered {path}: kept {state['lines']} complete lines, dropped the rest left by an interrupted run")
+    return state["lines"]
+
+def sidecar_parts(path):
+    """Returns the committed part files of a run_single_file.py --sidecar directory, in order."""
+    return sorted(glob.glob(os.path.join(path, "part-*.parquet")))
+
+def corpus_schema():
+    """Schema of the standardised corpus written by standardise_corpus.py."""
+    import pyarrow as pa
+    return pa.schema([
+        ("id", pa.string()),
+        ("text", pa.large_string()),
+        ("edu_score", pa.float64()),
+        ("ling_score", pa.float64()),
+        ("doc_type", pa.string()),
+    ])
+
+class ParquetRecordWriter:
+    """Buffers record dicts and writes them as zstd-compressed row groups of row_group_size rows."""
+
+    def __init__(self, path, schema, row_group_size=DEFAULT_ROW_GROUP_SIZE, compression_level=None):
+        import pyarrow.parquet as pq
+        self.schema = schema
+        self.row_group_size = row_group_size
+        self.writer = pq.ParquetWriter(path, schema, compression="zstd", compression_level=compression_level)
+        self.buffer = []
+
+    def write(self, record):
+        self.buffer.append(record)
+        if len(self.buffer) >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            import pyarrow as pa
+            self.writer.write_table(pa.Table.from_pylist(self.buffer, schema=self.schema),
+                                    row_group_size=self.row_group_size)
+            self.buffer = []
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def iter_column_batches(path, columns, batch_size=DEFAULT_ROW_GROUP_SIZE):
+    """
+    Yields dicts mapping each requested column to a list of values, batch_size
+    rows at a time. Columns absent from the file come back as lists of None.
+    """
+    if is_parquet(path):
+        import pyarrow.parquet as pq
+        parquet_file = pq.ParquetFile(path)
+        present = [c for c in columns if c in parquet_file.schema_arrow.names]
+        if not present:
+            # Still honour the row count so callers see every row.
+            for group in range(parquet_file.num_row_groups):
+                num_rows = parquet_file.metadata.row_group(group).num_rows
+                yield {c: [None] * num_rows for c in columns}
+            return
+        for batch in parquet_file.iter_batches(batch_size=batch_size, columns=present):
+            values = {c: batch.column(c).to_pylist() for c in present}
+            yield {c: values.get(c, [None] * batch.num_rows) for c in columns}
+        return
+
+    with open_text(path) as f:
+        batch = {c: [] for c in columns}
+        size = 0
+        for line in f:
+            record = json.loads(line)
+            for c in columns:
+                batch[c].append(record.get(c))
+            size += 1
+            if size >= batch_size:
+                yield batch
+                batch = {c: [] for c in columns}
+                size = 0
+        if size:
+            yield batch
+
+def iter_records(path, columns=None, batch_size=DEFAULT_ROW_GROUP_SIZE):
+    """Yields one dict per row, restricted to columns when given."""
+    if columns is None:
+        if is_parquet(path):
+            import pyarrow.parquet as pq
+            for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size):
+                yield from batch.to_pylist()
+        else:
+            with open_text(path) as f:
+                for line in f:
+                    yield json.loads(line)
+        return
+    for batch in iter_column_batches(path, columns, batch_size):
+        yield from (dict(zip(columns, values)) for values in zip(*(batch[c] for c in columns)))
@@ -6,6 +6,8 @@ from transformers import AutoTokenizer
 from tqdm import tqdm
 import mmap
 
+from corpus_io import COMPRESSION_SUFFIXES, list_jsonl_files, open_text
+
 def parse_arguments():
     parser = argparse.ArgumentParser(description="Estimate token count in JSONL files using Llama 3 tokenizer.")
     parser.add_argument("--input_file", type=str, help="Path to the input JSONL file.")
@@ -18,7 +20,11 @@ def count_lines(file_path):
         # Check if file is empty first
         if os.path.getsize(file_path) == 0:
             return 0
-            
+        # A compressed file has to be decompressed to count its lines
+        if file_path.endswith(COMPRESSION_SUFFIXES):
+            with open_text(file_path) as f:
+                return sum(1 for _ in f)
+
         with open(file_path, 'r', encoding='utf-8') as f:
             buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
             return sum(1 for _ in iter(buf.readline, b""))
@@ -28,7 +34,7 @@ def count_lines(file_path):
 
 def sample_lines(file_path, sample_size):
     samples = []
-    with open(file_path, 'r', encoding='utf-8') as f:
+    with open_text(file_path) as f:
         for i, line in enumerate(f):
             if i >= sample_size:
                 break
@@ -61,24 +67,23 @@ def process_files_in_directory(directory, sample_size):
     markdown_lines = ["| File Name | Estimated Token Count (B) |", "| --- | ---: |"]
     total_tokens = 0.0
 
-    for file_name in os.listdir(directory):
-        if file_name.endswith(".jsonl"):
-            file_path = os.path.join(directory, file_name)
+    for file_path in list_jsonl_files(directory):
+        file_name = os.path.basename(file_path)
+        
+        # Skip empty files immediately
+        if os.path.getsize(file_path) == 0:
+            print(f"⚠️  Skipping empty file: {file_name}")
+            continue
             
-            # Skip empty files immediately
-            if os.path.getsize(file_path) == 0:
-                print(f"⚠️  Skipping empty file: {file_name}")
-                continue
-                
-            estimated_tokens = estimate_token_count(file_path, sample_size)
+        estimated_tokens = estimate_token_count(file_path, sample_size)
+        
+        # Skip files with 0 estimated tokens
+        if estimated_tokens <= 0:
+            print(f"⚠️  Skipping file with 0 tokens: {file_name}")
+            continue
             
-            # Skip files with 0 estimated tokens
-            if estimated_tokens <= 0:
-                print(f"⚠️  Skipping file with 0 tokens: {file_name}")
-                continue
-                
-            markdown_lines.append(f"| {file_name} | {estimated_tokens:.3f} |")
-            total_tokens += estimated_tokens
+        markdown_lines.append(f"| {file_name} | {estimated_tokens:.3f} |")
+        total_tokens += estimated_tokens
 
     markdown_lines.append(f"| **Total** | **{total_tokens:.3f}** |")
     markdown_output = "\n".join(markdown_lines)
@@ -1,74 +1,175 @@
 import pandas as pd
 import json
 import argparse
+import os
+import re
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 
-def read_jsonlines(filepath, limit=None):
-    data = []
-    with open(filepath, 'r', encoding='utf-8') as file:
+from corpus_io import is_parquet, iter_column_batches, open_text
+
+# Only the two integer scores are read; the rest of the record (mostly text) is never decoded.
+# The leading quote keeps "int_score" from matching inside "ling_int_score".
+INT_SCORE_PATTERN = re.compile(r'"int_score":\s*(-?\d+)\s*[,}]')
+LING_INT_SCORE_PATTERN = re.compile(r'"ling_int_score":\s*(-?\d+)\s*[,}]')
+MISSING = np.iinfo(np.int64).min
+
+def extract_score(line, key, pattern):
+    """Returns the integer score in a JSON line, or MISSING, decoding the full line only when the pattern cannot tell."""
+    if f'"{key}"' not in line:
+        return MISSING
+    match = pattern.search(line)
+    if match:
+        return int(match.group(1))
+    value = json.loads(line).get(key)
+    return MISSING if value is None else int(value)
+
+class ScoreCounts:
+    """
+    Counts of int_score, ling_int_score and their pairs, kept in small NumPy
+    arrays indexed by score - low and grown when a new score value appears.
+    Counts from several files are combined with merge.
+    """
+
+    def __init__(self):
+        self.low = 0
+        self.edu = np.zeros(0, dtype=np.int64)
+        self.ling = np.zeros(0, dtype=np.int64)
+        self.cross = np.zeros((0, 0), dtype=np.int64)
+        self.has_edu = False
+        self.has_ling = False
+
+    def _fit(self, low, high):
+        if len(self.edu):
+            low, high = min(low, self.low), max(high, self.low + len(self.edu) - 1)
+        before = self.low - low if len(self.edu) else 0
+        after = high - low + 1 - before - len(self.edu)
+        self.edu = np.pad(self.edu, (before, after))
+        self.ling = np.pad(self.ling, (before, after))
+        self.cross = np.pad(self.cross, ((before, after), (before, after)))
+        self.low = low
+
+    def add(self, edu, ling):
+        edu = np.asarray(edu, dtype=np.int64)
+        ling = np.asarray(ling, dtype=np.int64)
+        has_edu = edu != MISSING
+        has_ling = ling != MISSING
+        present = np.concatenate([edu[has_edu], ling[has_ling]])
+        if not len(present):
+            return
+        self._fit(int(present.min()), int(present.max()))
+        self.has_edu |= bool(has_edu.any())
+        self.has_ling |= bool(has_ling.any())
+        self.edu += np.bincount(edu[has_edu] - self.low, minlength=len(self.edu))
+        self.ling += np.bincount(ling[has_ling] - self.low, minlength=len(self.ling))
+        both = has_edu & has_ling
+        np.add.at(self.cross, (edu[both] - self.low, ling[both] - self.low), 1)
+
+    def merge(self, other):
+        if not len(other.edu):
+            return self
+        self._fit(other.low, other.low + len(other.edu) - 1)
+        offset = other.low - self.low
+        size = len(other.edu)
+        self.edu[offset:offset + size] += other.edu
+        self.ling[offset:offset + size] += other.ling
+        self.cross[offset:offset + size, offset:offset + size] += other.cross
+        self.has_edu |= other.has_edu
+        self.has_ling |= other.has_ling
+        return self
+
+def read_parquet_score_counts(filepath, limit=None, chunk_size=100000):
+    """Parquet files only read the two score columns."""
+    counts = ScoreCounts()
+    remaining = limit
+    for batch in iter_column_batches(filepath, ['int_score', 'ling_int_score'], chunk_size):
+        edu, ling = batch['int_score'], batch['ling_int_score']
+        if remaining is not None:
+            edu, ling = edu[:remaining], ling[:remaining]
+            remaining -= len(edu)
+        counts.add([MISSING if v is None else int(v) for v in edu], [MISSING if v is None else int(v) for v in ling])
+        if remaining == 0:
+            break
+    return counts
+
+def read_score_counts(filepath, limit=None, chunk_size=100000):
+    if is_parquet(filepath):
+        return read_parquet_score_counts(filepath, limit, chunk_size)
+    counts = ScoreCounts()
+    edu, ling = [], []
+    with open_text(filepath) as file:
         for i, line in enumerate(file):
             if limit is not None and i >= limit:
                 break
-            data.append(json.loads(line))
-    return data
+            edu.append(extract_score(line, 'int_score', INT_SCORE_PATTERN))
+            ling.append(extract_score(line, 'ling_int_score', LING_INT_SCORE_PATTERN))
+            if len(edu) >= chunk_size:
+                counts.add(edu, ling)
+                edu, ling = [], []
+    counts.add(edu, ling)
+    return counts
 
-def create_cross_table(data, input_file):
-    df = pd.DataFrame(data)
-    if 'int_score' not in df.columns or 'ling_int_score' not in df.columns:
+def _percentage_table(counts, low, index_name):
+    values = np.flatnonzero(counts)
+    table = pd.Series(counts[values] / counts[values].sum() * 100,
+                      index=pd.Index(values + low, name=index_name), name='percentage')
+    return table
+
+def create_cross_table(counts, input_file):
+    if not (counts.has_edu and counts.has_ling):
         print(f"There are no values like 'int_score' or 'ling_int_score' in {input_file}")
         return None
-    df = df.sort_values(by='int_score')
-    cross_table = pd.crosstab(df['int_score'], df['ling_int_score'], normalize='index') * 100
+    rows = np.flatnonzero(counts.cross.sum(axis=1))
+    columns = np.flatnonzero(counts.cross.sum(axis=0))
+    cross = counts.cross[np.ix_(rows, columns)]
+    cross_table = pd.DataFrame(cross / cross.sum(axis=1, keepdims=True) * 100,
+                               index=pd.Index(rows + counts.low, name='int_score'),
+                               columns=pd.Index(columns + counts.low, name='ling_int_score'))
     return cross_table
 
-def create_int_score_table(data, input_file):
-    df = pd.DataFrame(data)
-    if 'int_score' not in df.columns:
+def create_int_score_table(counts, input_file):
+    if not counts.has_edu:
         print(f"There are no values like 'int_score' in {input_file}")
         return None
-    df = df.sort_values(by='int_score')
-    int_score_table = df['int_score'].value_counts(normalize=True).sort_index() * 100
-    int_score_table.index.name = 'edu_int_score'
-    int_score_table.name = 'percentage'
-    return int_score_table
-
-def create_ling_int_score_table(data, input_file):
-    df = pd.DataFrame(data)
-    if 'ling_int_score' not in df.columns:
+    return _percentage_table(counts.edu, counts.low, 'edu_int_score')
+
+def create_ling_int_score_table(counts, input_file):
+    if not counts.has_ling:
         print(f"There are no values like 'ling_int_score' in {input_file}")
         return None
-    df = df.sort_values(by='int_score')
-    ling_int_score_table = df['ling_int_score'].value_counts(normalize=True).sort_index() * 100
-    ling_int_score_table.index.name = 'ling_int_score'
-    ling_int_score_table.name = 'percentage'
-    return ling_int_score_table
-
-def main(input_file, edu, ling, limit):
-    data = read_jsonlines(input_file, limit)
-    
-    print(input_file)  # Print the input file name
-    
-    if edu:
-        int_score_table = create_int_score_table(data, input_file)
-        if int_score_table is not None:
-            markdown_table = int_score_table.to_markdown()
-            print(markdown_table)
-    elif ling:
-        ling_int_score_table = create_ling_int_score_table(data, input_file)
-        if ling_int_score_table is not None:
-            markdown_table = ling_int_score_table.to_markdown()
-            print(markdown_table)
-    else:
-        cross_table = create_cross_table(data, input_file)
-        if cross_table is not None:
-            markdown_table = cross_table.to_markdown()
+    return _percentage_table(counts.ling, counts.low, 'ling_int_score')
+
+def main(input_files, edu, ling, all_tables, limit, max_cpu_count=48):
+    num_workers = max(1, min(os.cpu_count(), max_cpu_count, len(input_files)))
+    counts = ScoreCounts()
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        for file_counts in executor.map(read_score_counts, input_files, [limit] * len(input_files)):
+            counts.merge(file_counts)
+
+    input_file = ", ".join(input_files)
+    print(input_file)  # Print the input file name(s)
+
+    tables = []
+    if all_tables or edu:
+        tables.append(create_int_score_table(counts, input_file))
+    if all_tables or ling:
+        tables.append(create_ling_int_score_table(counts, input_file))
+    if all_tables or not (edu or ling):
+        tables.append(create_cross_table(counts, input_file))
+
+    for table in tables:
+        if table is not None:
+            markdown_table = table.to_markdown()
             print(markdown_table)
 
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="Create tables from JSON lines file.")
-    parser.add_argument('--input_file', type=str, required=True, help='Path to the input JSON lines file.')
+    parser = argparse.ArgumentParser(description="Create tables from JSON lines files.")
+    parser.add_argument('--input_file', type=str, required=True, nargs='+', help='Path to one or more input JSON lines or Parquet files.')
     parser.add_argument('--edu', action='store_true', help='Create table for edu_int_score only.')
     parser.add_argument('--ling', action='store_true', help='Create table for ling_int_score only.')
-    parser.add_argument('--limit', type=int, help='Limit the number of lines read from the file.')
+    parser.add_argument('--all', action='store_true', help='Create the edu, ling and cross tables from the same pass.')
+    parser.add_argument('--limit', type=int, help='Limit the number of lines read from each file.')
+    parser.add_argument('--max_cpu_count', type=int, default=48, help='Maximum number of files read concurrently.')
 
     args = parser.parse_args()
-    main(args.input_file, args.edu, args.ling, args.limit)
+    main(args.input_file, args.edu, args.ling, args.all, args.limit, args.max_cpu_count)
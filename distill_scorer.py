@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+"""
+Cheap CPU stand-in for the BERT education classifier.
+
+`train` fits a linear regressor on hashed word n-grams to a sample of the
+scores written by run_single_file.py and reports how well it agrees with them.
+`score` applies it to a whole corpus in a multi-process pass. With
+--min_edu_score it also splits the corpus for a cascade: documents whose cheap
+score is within --margin of the threshold go to --uncertain_file, to be scored
+by run_single_file.py. Documents clearly above the threshold go to
+--output_file, and documents clearly below it are dropped. A kept document
+without a model score gets the cheap score as score and int_score, so that
+filter_dataset.py accepts it alongside the uncertain documents once
+run_single_file.py has scored them.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import pickle
+import random
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.linear_model import Ridge, SGDRegressor
+
+from corpus_io import open_text
+
+def make_vectorizer(n_features):
+    return HashingVectorizer(n_features=n_features, ngram_range=(1, 2), alternate_sign=False, norm="l2")
+
+def sample_scored_records(input_files, sample_size, text_column, score_column, seed=42):
+    """Reservoir-samples (text, score) pairs from run_single_file.py output."""
+    rng = random.Random(seed)
+    sample = []
+    seen = 0
+    for input_file in input_files:
+        with open_text(input_file) as f:
+            for line in f:
+                record = json.loads(line)
+                text, score = record.get(text_column), record.get(score_column)
+                if not isinstance(text, str) or score is None:
+                    continue
+                seen += 1
+                if len(sample) < sample_size:
+                    sample.append((text, float(score)))
+                else:
+                    j = rng.randrange(seen)
+                    if j < sample_size:
+                        sample[j] = (text, float(score))
+    print(f"Sampled {len(sample)} of {seen} scored documents")
+    return sample
+
+def agreement_report(predicted, target, min_edu_score=None, margin=0.0):
+    """Correlation and error against the model scores and, with a threshold, how often the keep/drop decision agrees."""
+    report = {
+        "documents": len(target),
+        "rmse": float(np.sqrt(np.mean((predicted - target) ** 2))),
+        "pearson": float(np.corrcoef(predicted, target)[0, 1]) if len(target) > 1 else None,
+    }
+    if min_edu_score is not None:
+        keep = target >= min_edu_score
+        report["decision_agreement"] = float(np.mean((predicted >= min_edu_score) == keep))
+        uncertain = np.abs(predicted - min_edu_score) <= margin
+        decided = ~uncertain
+        report["cascade_sent_to_model"] = float(np.mean(uncertain))
+        report["cascade_decision_agreement"] = float(np.mean((predicted[decided] >= min_edu_score) == keep[decided])) if decided.any() else None
+    return report
+
+def train(args):
+    sample = sample_scored_records(args.input_file, args.sample_size, args.text_column, args.score_column, args.seed)
+    random.Random(args.seed).shuffle(sample)
+    num_test = int(len(sample) * args.test_fraction)
+    texts = [text for text, _ in sample]
+    scores = np.array([score for _, score in sample])
+
+    vectorizer = make_vectorizer(args.n_features)
+    start_time = time.time()
+    features = vectorizer.transform(texts)
+    if args.regressor == "ridge":
+        regressor = Ridge(alpha=args.alpha)
+    else:
+        regressor = SGDRegressor(alpha=args.alpha, max_iter=20, tol=1e-4, random_state=args.seed)
+    regressor.fit(features[num_test:], scores[num_test:])
+    print(f"Trained {args.regressor} on {len(sample) - num_test} documents in {time.time() - start_time:.1f} seconds")
+
+    if num_test:
+        report = agreement_report(regressor.predict(features[:num_test]), scores[:num_test], args.min_edu_score, args.margin)
+        print(json.dumps(report, indent=2))
+
+    with open(args.model_file, "wb") as f:
+        pickle.dump({"n_features": args.n_features, "text_column": args.text_column, "regressor": regressor}, f)
+    print(f"Model saved to {args.model_file}")
+
+_model = None
+
+def _init_worker(model_file):
+    global _model
+    with open(model_file, "rb") as f:
+        _model = pickle.load(f)
+    _model["vectorizer"] = make_vectorizer(_model["n_features"])
+
+def score_chunk(lines):
+    """Returns (record, cheap_score) for every decodable line with a text."""
+    records = []
+    for line in lines:
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        if isinstance(record.get(_model["text_column"]), str):
+            records.append(record)
+    if not records:
+        return []
+    features = _model["vectorizer"].transform([record[_model["text_column"]] for record in records])
+    return list(zip(records, _model["regressor"].predict(features).tolist()))
+
+def read_in_chunks(file_object, chunk_size=1000):
+    chunk = []
+    for line in file_object:
+        chunk.append(line)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def score(args):
+    num_cores = max(1, min(os.cpu_count(), args.max_cpu_count))
+    cascade = args.min_edu_score is not None
+    counts = {"total": 0, "kept": 0, "uncertain": 0, "dropped": 0}
+    start_time = time.time()
+
+    with open_text(args.input_file) as infile, \
+         open_text(args.output_file, "w") as outfile, \
+         (open_text(args.uncertain_file, "w") if cascade else contextlib.nullcontext()) as uncertain_file, \
+         ProcessPoolExecutor(max_workers=num_cores, initializer=_init_worker, initargs=(args.model_file,)) as executor:
+
+        def write_results(results):
+            for record, cheap_score in results:
+                counts["total"] += 1
+                record["cheap_score"] = cheap_score
+                if cascade and abs(cheap_score - args.min_edu_score) <= args.margin:
+                    counts["uncertain"] += 1
+                    uncertain_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+                elif cascade and cheap_score < args.min_edu_score:
+                    counts["dropped"] += 1
+                else:
+                    counts["kept"] += 1
+                    if cascade and "score" not in record:
+                        # Stands in for the model score, as run_single_file.py would write it
+                        record["score"] = cheap_score
+                        record["int_score"] = int(round(max(0, min(cheap_score, 5))))
+                    outfile.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+        # Bounded number of chunks in flight, consumed in order
+        pending = deque()
+        for chunk in read_in_chunks(infile, args.chunk_size):
+            pending.append(executor.submit(score_chunk, chunk))
+            if len(pending) >= num_cores * 2:
+                write_results(pending.popleft().result())
+        while pending:
+            write_results(pending.popleft().result())
+
+    elapsed = time.time() - start_time
+    print(f"Scored {counts['total']} documents in {elapsed:.1f} seconds ({counts['total'] / max(elapsed, 1e-9):.0f} documents/s)")
+    if cascade:
+        print(f"- Kept: {counts['kept']}")
+        print(f"- Sent to the model: {counts['uncertain']} ({counts['uncertain'] / max(counts['total'], 1):.1%})")
+        print(f"- Dropped: {counts['dropped']}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Train and apply a hashed n-gram regressor that approximates the education classifier.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    train_parser = subparsers.add_parser("train", help="Fit the regressor to scores from run_single_file.py.")
+    train_parser.add_argument("--input_file", required=True, nargs="+", help="Scored jsonlines files from run_single_file.py.")
+    train_parser.add_argument("--model_file", required=True, help="Where to save the trained model.")
+    train_parser.add_argument("--text_column", default="text")
+    train_parser.add_argument("--score_column", default="score", help="Model score to learn.")
+    train_parser.add_argument("--sample_size", type=int, default=200000, help="Number of documents sampled for training and testing.")
+    train_parser.add_argument("--test_fraction", type=float, default=0.1, help="Fraction of the sample held out for the agreement report.")
+    train_parser.add_argument("--regressor", choices=["sgd", "ridge"], default="sgd")
+    train_parser.add_argument("--alpha", type=float, default=1e-6, help="Regularisation strength.")
+    train_parser.add_argument("--n_features", type=int, default=2 ** 20, help="Number of hashed features.")
+    train_parser.add_argument("--min_edu_score", type=float, help="Threshold used by filter_dataset.py, for the agreement report.")
+    train_parser.add_argument("--margin", type=float, default=0.5, help="Cascade margin around --min_edu_score for the agreement report.")
+    train_parser.add_argument("--seed", type=int, default=42)
+
+    score_parser = subparsers.add_parser("score", help="Score a corpus with a trained model.")
+    score_parser.add_argument("--input_file", required=True, help="Path to the input jsonlines file.")
+    score_parser.add_argument("--output_file", required=True, help="Documents with a cheap_score column; with --min_edu_score only those clearly above it, which also get it as score/int_score if they have no score.")
+    score_parser.add_argument("--model_file", required=True, help="Model saved by train.")
+    score_parser.add_argument("--min_edu_score", type=float, help="Threshold for the cascade.")
+    score_parser.add_argument("--margin", type=float, default=0.5, help="Documents within this distance of --min_edu_score are uncertain.")
+    score_parser.add_argument("--uncertain_file", help="Where to write uncertain documents for run_single_file.py. Required with --min_edu_score.")
+    score_parser.add_argument("--chunk_size", type=int, default=1000, help="Lines per worker task.")
+    score_parser.add_argument("--max_cpu_count", type=int, default=48, help="Maximum number of CPU cores to use.")
+
+    args = parser.parse_args()
+    if args.command == "score" and args.uncertain_file and args.min_edu_score is None:
+        parser.error("--uncertain_file needs --min_edu_score")
+    if args.command == "score" and args.min_edu_score is not None and not args.uncertain_file:
+        parser.error("--min_edu_score needs --uncertain_file, or the documents within --margin of it would be lost")
+    if args.command == "train":
+        train(args)
+    else:
+        score(args)
+
+if __name__ == "__main__":
+    main()
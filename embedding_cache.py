@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+"""
+Persistent sentence-embedding cache.
+
+Embeddings live in a memory-mapped float16 matrix (embeddings.f16) with one
+row per distinct sentence, in the order they were added. index.u64 holds
+(hash, row) pairs sorted by the 8-byte blake2b hash of the sentence, so a
+lookup is a binary search. meta.json records the model and dimension so a
+cache built with one model is never read with another.
+
+New pairs are appended unsorted to index.log.u64, so adding a window costs
+time in the size of the window, not of the cache. In memory the index is a
+few sorted runs of growing size, merged like a binary counter, so each pair
+is merged O(log n) times. The log is merged into the index on open and
+written back into index.u64 on close. The matrix is
+always appended and flushed before the log; rows no index entry references
+(from an interrupted run) are truncated on open.
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+EMBEDDINGS_FILE = "embeddings.f16"
+INDEX_FILE = "index.u64"
+LOG_FILE = "index.log.u64"
+META_FILE = "meta.json"
+
+def sentence_hash(sentence):
+    return int.from_bytes(hashlib.blake2b(sentence.encode("utf-8"), digest_size=8).digest(), "little")
+
+def sentence_hashes(sentences):
+    return np.fromiter((sentence_hash(s) for s in sentences), dtype=np.uint64, count=len(sentences))
+
+def _read_pairs(path):
+    if not os.path.exists(path):
+        return np.empty((0, 2), dtype=np.uint64)
+    with open(path, "rb") as f:
+        data = f.read()
+    # A torn write at the end of the log leaves an incomplete pair
+    pair_size = 2 * np.dtype(np.uint64).itemsize
+    return np.frombuffer(data[:len(data) - len(data) % pair_size], dtype=np.uint64).reshape(-1, 2).copy()
+
+def _sorted_pairs(hashes, rows):
+    """Sorts by hash, keeping one pair per hash (a log replayed after a crash can repeat pairs)."""
+    hashes, first = np.unique(hashes, return_index=True)
+    return hashes, rows[first]
+
+def _search(sorted_hashes, sorted_rows, hashes):
+    rows = np.full(len(hashes), -1, dtype=np.int64)
+    if not len(sorted_hashes):
+        return rows
+    positions = np.minimum(np.searchsorted(sorted_hashes, hashes), len(sorted_hashes) - 1)
+    found = sorted_hashes[positions] == hashes
+    rows[found] = sorted_rows[positions[found]]
+    return rows
+
+class EmbeddingCache:
+    def __init__(self, cache_dir, model_name):
+        self.cache_dir = cache_dir
+        self.model_name = model_name
+        os.makedirs(cache_dir, exist_ok=True)
+        self.embeddings_path = os.path.join(cache_dir, EMBEDDINGS_FILE)
+        self.index_path = os.path.join(cache_dir, INDEX_FILE)
+        self.meta_path = os.path.join(cache_dir, META_FILE)
+        self.log_path = os.path.join(cache_dir, LOG_FILE)
+
+        self.dim = None
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta["model"] != model_name:
+                raise ValueError(f"Embedding cache {cache_dir} was built with {meta['model']}, not {model_name}.")
+            self.dim = meta["dim"]
+
+        pairs = np.concatenate([_read_pairs(self.index_path), _read_pairs(self.log_path)])
+        hashes, rows = _sorted_pairs(pairs[:, 0], pairs[:, 1])
+        # Sorted (hashes, rows) runs, largest first
+        self._runs = [(hashes, rows)] if len(hashes) else []
+        self.num_rows = len(rows)
+
+        if self.dim is not None and os.path.exists(self.embeddings_path):
+            expected_size = self.num_rows * self.dim * 2
+            if os.path.getsize(self.embeddings_path) > expected_size:
+                os.truncate(self.embeddings_path, expected_size)
+        self._matrix = None
+
+    def __len__(self):
+        return self.num_rows
+
+    def _open_matrix(self):
+        if self._matrix is None or len(self._matrix) != self.num_rows:
+            self._matrix = np.memmap(self.embeddings_path, dtype=np.float16, mode="r",
+                                     shape=(self.num_rows, self.dim)) if self.num_rows else None
+        return self._matrix
+
+    def lookup(self, hashes):
+        """Returns the matrix row of each hash, or -1 where it is not cached."""
+        rows = np.full(len(hashes), -1, dtype=np.int64)
+        for run_hashes, run_rows in self._runs:
+            missing = np.flatnonzero(rows == -1)
+            if not len(missing):
+                break
+            rows[missing] = _search(run_hashes, run_rows, hashes[missing])
+        return rows
+
+    def get(self, rows):
+        """Returns the cached embeddings of the given rows as float32."""
+        return np.asarray(self._open_matrix()[rows], dtype=np.float32)
+
+    def add(self, hashes, embeddings):
+        """Appends embeddings for hashes not already cached and logs their index entries."""
+        hashes, unique = np.unique(hashes, return_index=True)
+        embeddings = np.asarray(embeddings)[unique]
+        new = self.lookup(hashes) == -1
+        hashes, embeddings = hashes[new], embeddings[new]
+        if not len(hashes):
+            return
+
+        if self.dim is None:
+            self.dim = embeddings.shape[1]
+            with open(self.meta_path, "w", encoding="utf-8") as f:
+                json.dump({"model": self.model_name, "dim": self.dim}, f)
+
+        with open(self.embeddings_path, "ab") as f:
+            f.write(embeddings.astype(np.float16).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+        rows = np.arange(self.num_rows, self.num_rows + len(hashes), dtype=np.uint64)
+        with open(self.log_path, "ab") as f:
+            f.write(np.stack([hashes, rows], axis=1).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        self.num_rows += len(hashes)
+
+        # hashes is sorted; merge it with the smaller runs it outgrows
+        run = (hashes, rows)
+        while self._runs and len(self._runs[-1][0]) <= len(run[0]):
+            run = self._merge_runs([self._runs.pop(), run])
+        self._runs.append(run)
+
+    @staticmethod
+    def _merge_runs(runs):
+        return _sorted_pairs(np.concatenate([hashes for hashes, _ in runs]),
+                             np.concatenate([rows for _, rows in runs]))
+
+    def close(self):
+        """Writes the merged index to index.u64 and removes the log."""
+        if not os.path.exists(self.log_path):
+            return
+        if len(self._runs) > 1:
+            self._runs = [self._merge_runs(self._runs)]
+        hashes, rows = self._runs[0] if self._runs else (np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.uint64))
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(np.stack([hashes, rows], axis=1).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.index_path)
+        # If this is lost, the log is replayed on open; its pairs are already in the index.
+        os.remove(self.log_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def encode(self, sentences, encode_fn):
+        """
+        Returns float32 embeddings for sentences, calling encode_fn only on the
+        distinct sentences that are not cached yet.
+        """
+        hashes = sentence_hashes(sentences)
+        rows = self.lookup(hashes)
+        missing = np.flatnonzero(rows == -1)
+        if len(missing):
+            missing_hashes, first = np.unique(hashes[missing], return_index=True)
+            self.add(missing_hashes, encode_fn([sentences[i] for i in missing[first]]))
+            rows = self.lookup(hashes)
+        return self.get(rows)
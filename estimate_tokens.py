@@ -6,6 +6,8 @@ from transformers import GPT2Tokenizer
 from tqdm import tqdm
 import mmap
 
+from corpus_io import COMPRESSION_SUFFIXES, list_jsonl_files, open_text
+
 def parse_arguments():
     parser = argparse.ArgumentParser(description="Estimate token count in JSONL files.")
     parser.add_argument("--input_file", type=str, help="Path to the input JSONL file.")
@@ -14,13 +16,17 @@ def parse_arguments():
     return parser.parse_args()
 
 def count_lines(file_path):
+    # A compressed file has to be decompressed to count its lines
+    if file_path.endswith(COMPRESSION_SUFFIXES):
+        with open_text(file_path) as f:
+            return sum(1 for _ in f)
     with open(file_path, 'r', encoding='utf-8') as f:
         buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
         return sum(1 for _ in iter(buf.readline, b""))
 
 def sample_lines(file_path, sample_size):
     samples = []
-    with open(file_path, 'r', encoding='utf-8') as f:
+    with open_text(file_path) as f:
         for i, line in enumerate(f):
             if i >= sample_size:
                 break
@@ -49,12 +55,11 @@ def process_files_in_directory(directory, sample_size):
     markdown_lines = ["| File Name | Estimated Token Count (B) |", "| --- | ---: |"]
     total_tokens = 0.0
 
-    for file_name in os.listdir(directory):
-        if file_name.endswith(".jsonl"):
-            file_path = os.path.join(directory, file_name)
-            estimated_tokens = estimate_token_count(file_path, sample_size)
-            markdown_lines.append(f"| {file_name} | {estimated_tokens:.1f} |")
-            total_tokens += estimated_tokens
+    for file_path in list_jsonl_files(directory):
+        file_name = os.path.basename(file_path)
+        estimated_tokens = estimate_token_count(file_path, sample_size)
+        markdown_lines.append(f"| {file_name} | {estimated_tokens:.1f} |")
+        total_tokens += estimated_tokens
 
     markdown_lines.append(f"| **Total** | **{total_tokens:.1f}** |")
     markdown_output = "\n".join(markdown_lines)
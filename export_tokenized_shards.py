@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+"""
+Tokenizes the shuffled corpus shards once and stores them as flat token arrays.
+
+For every input shard `train_000.jsonl` this writes `train_000.bin`, all token
+ids back to back as uint16 (when the vocabulary fits) or uint32, and
+`train_000.idx`, which holds a header followed by num_docs + 1 uint64 token
+offsets. Document i is bin[offsets[i]:offsets[i + 1]] and documents keep
+their line order, so the output is deterministic. A line without a string
+text gets an empty document, which keeps the index aligned with the shard lines.
+
+TokenizedShard memory-maps both files for O(1) document access during training.
+"""
+
+import argparse
+import glob
+import json
+import os
+import struct
+import time
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from corpus_io import base_name, list_jsonl_files, open_text
+
+INDEX_MAGIC = b"NCCTOK\x00\x00"
+INDEX_VERSION = 1
+# magic, version, token itemsize, number of documents
+INDEX_HEADER = struct.Struct("<8sQQQ")
+
+class TokenizedShard:
+    """Read-only view of a .bin/.idx pair; shard[i] is the token array of document i."""
+
+    def __init__(self, prefix):
+        with open(prefix + ".idx", "rb") as f:
+            magic, version, itemsize, num_docs = INDEX_HEADER.unpack(f.read(INDEX_HEADER.size))
+        if magic != INDEX_MAGIC or version != INDEX_VERSION:
+            raise ValueError(f"{prefix}.idx is not a version {INDEX_VERSION} token index")
+        self.dtype = np.uint16 if itemsize == 2 else np.uint32
+        self.offsets = np.memmap(prefix + ".idx", dtype=np.uint64, mode="r",
+                                 offset=INDEX_HEADER.size, shape=(num_docs + 1,))
+        num_tokens = int(self.offsets[-1])
+        # np.memmap cannot map an empty file
+        self.tokens = (np.memmap(prefix + ".bin", dtype=self.dtype, mode="r", shape=(num_tokens,))
+                       if num_tokens else np.zeros(0, dtype=self.dtype))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self.tokens[int(self.offsets[i]):int(self.offsets[i + 1])]
+
+    @property
+    def num_tokens(self):
+        return int(self.offsets[-1])
+
+def token_dtype(tokenizer):
+    return np.uint16 if len(tokenizer) <= np.iinfo(np.uint16).max + 1 else np.uint32
+
+_tokenizer = None
+_settings = None
+
+def _init_worker(tokenizer_name, text_column, append_eos):
+    global _tokenizer, _settings
+    from transformers import AutoTokenizer
+    _tokenizer = AutoTokenizer.from_pretrained(tokenizer_name)
+    _settings = (text_column, append_eos, token_dtype(_tokenizer))
+
+def tokenize_chunk(lines):
+    """Returns the concatenated token ids of the lines and the length of each document."""
+    text_column, append_eos, dtype = _settings
+    texts = []
+    for line in lines:
+        try:
+            text = json.loads(line).get(text_column)
+        except json.JSONDecodeError:
+            text = None
+        texts.append(text if isinstance(text, str) else "")
+    encoded = _tokenizer(texts, add_special_tokens=False)["input_ids"]
+    if append_eos:
+        encoded = [ids + [_tokenizer.eos_token_id] if text else ids for ids, text in zip(encoded, texts)]
+    lengths = np.fromiter((len(ids) for ids in encoded), dtype=np.uint64, count=len(encoded))
+    tokens = np.fromiter((token for ids in encoded for token in ids), dtype=dtype, count=int(lengths.sum()))
+    return tokens, lengths
+
+def read_in_chunks(file_object, chunk_size=1000):
+    chunk = []
+    for line in file_object:
+        chunk.append(line)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def export_shard(input_file, prefix, executor, num_cores, itemsize, chunk_size):
+    offsets = array("Q", [0])
+    bin_tmp = prefix + ".bin.tmp"
+    idx_tmp = prefix + ".idx.tmp"
+    with open_text(input_file) as infile, open(bin_tmp, "wb") as bin_file:
+
+        def write_results(result):
+            tokens, lengths = result
+            bin_file.write(tokens.tobytes())
+            offsets.extend((np.cumsum(lengths) + offsets[-1]).tolist())
+
+        # Bounded number of chunks in flight, consumed in order
+        pending = deque()
+        for chunk in read_in_chunks(infile, chunk_size):
+            pending.append(executor.submit(tokenize_chunk, chunk))
+            if len(pending) >= num_cores * 2:
+                write_results(pending.popleft().result())
+        while pending:
+            write_results(pending.popleft().result())
+
+    with open(idx_tmp, "wb") as idx_file:
+        idx_file.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, itemsize, len(offsets) - 1))
+        idx_file.write(offsets.tobytes())
+    os.replace(bin_tmp, prefix + ".bin")
+    os.replace(idx_tmp, prefix + ".idx")
+    return len(offsets) - 1, offsets[-1]
+
+def collect_files(patterns):
+    files = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            files.extend(list_jsonl_files(pattern))
+        else:
+            files.extend(sorted(glob.glob(pattern)))
+    return files
+
+def main():
+    parser = argparse.ArgumentParser(description="Tokenize jsonlines shards into memory-mappable .bin/.idx token files.")
+    parser.add_argument("--input_file", required=True, nargs="+", help="Shards, directories or glob patterns.")
+    parser.add_argument("--output_dir", required=True, help="Directory for the .bin/.idx files.")
+    parser.add_argument("--tokenizer", default="meta-llama/Meta-Llama-3-8B", help="Hugging Face tokenizer to use.")
+    parser.add_argument("--text_column", default="text")
+    parser.add_argument("--append_eos", action="store_true", help="Append the tokenizer's EOS token to every non-empty document.")
+    parser.add_argument("--chunk_size", type=int, default=1000, help="Lines per worker task.")
+    parser.add_argument("--max_cpu_count", type=int, default=48, help="Maximum number of CPU cores to use.")
+    args = parser.parse_args()
+
+    from transformers import AutoTokenizer
+    tokenizer = AutoTokenizer.from_pretrained(args.tokenizer)
+    if args.append_eos and tokenizer.eos_token_id is None:
+        parser.error(f"{args.tokenizer} has no EOS token")
+    dtype = token_dtype(tokenizer)
+    print(f"Vocabulary size {len(tokenizer)}: storing tokens as {np.dtype(dtype).name}")
+
+    files = collect_files(args.input_file)
+    os.makedirs(args.output_dir, exist_ok=True)
+    num_cores = max(1, min(os.cpu_count(), args.max_cpu_count))
+
+    start_time = time.time()
+    total_docs = total_tokens = 0
+    with ProcessPoolExecutor(max_workers=num_cores, initializer=_init_worker,
+                             initargs=(args.tokenizer, args.text_column, args.append_eos)) as executor:
+        for input_file in files:
+            prefix = os.path.join(args.output_dir, base_name(input_file))
+            num_docs, num_tokens = export_shard(input_file, prefix, executor, num_cores, np.dtype(dtype).itemsize, args.chunk_size)
+            total_docs += num_docs
+            total_tokens += num_tokens
+            print(f"{input_file}: {num_docs} documents, {num_tokens} tokens -> {prefix}.bin")
+
+    elapsed = time.time() - start_time
+    print(f"Exported {total_docs} documents and {total_tokens} tokens from {len(files)} files in {elapsed:.1f} seconds "
+          f"({total_tokens / max(elapsed, 1e-9):.0f} tokens/s)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+import functools
+import glob
+import itertools
+import json
+import os
+import random
+from collections import deque
+
+from corpus_io import open_text
+
+def disjoint_shots(examples, num_shots=None, max_shots=9):
+    """
+    Groups consecutive examples into non-overlapping few-shot windows.
+
+    Yields (num_shots_actual, window) where num_shots_actual is num_shots, or a
+    random number between 1 and max_shots per window when num_shots is None.
+    The last window may be shorter. Only the current window is held in memory.
+    """
+    examples = iter(examples)
+    while True:
+        num_shots_actual = random.randint(1, max_shots) if num_shots is None else num_shots
+        window = list(itertools.islice(examples, num_shots_actual))
+        if not window:
+            return
+        yield num_shots_actual, window
+
+def sliding_shots(examples, num_shots=None, max_shots=9, stride=1):
+    """
+    Yields (num_shots_actual, window) for a window starting at every stride-th
+    example, so windows overlap when stride is smaller than the window. Only
+    the largest possible window is buffered.
+    """
+    if stride < 1:
+        raise ValueError(f"stride must be at least 1, got {stride}")
+    examples = iter(examples)
+    buffer_size = max(max_shots if num_shots is None else num_shots, stride)
+    buffer = deque(itertools.islice(examples, buffer_size))
+    while buffer:
+        num_shots_actual = random.randint(1, max_shots) if num_shots is None else num_shots
+        yield num_shots_actual, list(itertools.islice(buffer, num_shots_actual))
+        for _ in range(min(stride, len(buffer))):
+            buffer.popleft()
+        buffer.extend(itertools.islice(examples, buffer_size - len(buffer)))
+
+def random_shots(examples, num_shots=None, max_shots=9, pool_size=10000):
+    """
+    Yields (num_shots_actual, window) with each window drawn at random from a
+    pool of up to pool_size upcoming examples. Every example is used exactly
+    once, so the output size matches disjoint_shots.
+    """
+    if pool_size < 1:
+        raise ValueError(f"pool_size must be at least 1, got {pool_size}")
+    examples = iter(examples)
+    pool = list(itertools.islice(examples, pool_size))
+    while pool:
+        num_shots_actual = random.randint(1, max_shots) if num_shots is None else num_shots
+        window = []
+        for _ in range(min(num_shots_actual, len(pool))):
+            # Swap the drawn example with the last one so removal is O(1).
+            idx = random.randrange(len(pool))
+            pool[idx], pool[-1] = pool[-1], pool[idx]
+            window.append(pool.pop())
+        pool.extend(itertools.islice(examples, pool_size - len(pool)))
+        yield num_shots_actual, window
+
+def iter_dataset_rows(dataset, columns, batch_size=10000):
+    """
+    Yields tuples of the given columns from a Hugging Face dataset, decoding
+    one Arrow record batch at a time instead of a row dict per access.
+    """
+    dataset = dataset.select_columns(columns).with_format("arrow")
+    for table in dataset.iter(batch_size=batch_size):
+        yield from zip(*(table.column(name).to_pylist() for name in columns))
+
+def _build_shots_batch(batch, columns, format_example, source, num_shots, max_shots):
+    examples = [format_example(*row) for row in zip(*(batch[name] for name in columns))]
+    shots = {"source": [], "num_shots": [], "text": []}
+    for num_shots_actual, window in disjoint_shots(examples, num_shots, max_shots):
+        shots["source"].append(source)
+        shots["num_shots"].append(num_shots_actual)
+        shots["text"].append("\n\n".join(window))
+    return shots
+
+def write_few_shot_dataset(dataset, columns, format_example, output_file, source,
+                           num_shots=None, max_shots=9, batch_size=10000, num_proc=None):
+    """
+    Formats each row of `columns` with format_example, groups the results into
+    disjoint few-shot windows and writes one JSON line per window.
+
+    With num_proc > 1 the grouping runs as a batched Dataset.map over that many
+    processes; windows then never span a batch boundary.
+    """
+    if num_proc and num_proc > 1:
+        shots = dataset.select_columns(columns).map(
+            functools.partial(_build_shots_batch, columns=columns, format_example=format_example,
+                              source=source, num_shots=num_shots, max_shots=max_shots),
+            batched=True, batch_size=batch_size, num_proc=num_proc, remove_columns=columns,
+        )
+        records = ({"source": s, "num_shots": k, "text": t}
+                   for s, k, t in iter_dataset_rows(shots, ["source", "num_shots", "text"], batch_size))
+    else:
+        examples = (format_example(*row) for row in iter_dataset_rows(dataset, columns, batch_size))
+        records = ({"source": source, "num_shots": k, "text": "\n\n".join(window)}
+                   for k, window in disjoint_shots(examples, num_shots, max_shots))
+
+    with open_text(output_file, 'w') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+
+def load_hf_dataset(name, dataset_path=None, cache_dir=None, split='train'):
+    """
+    Loads a Hugging Face dataset split without touching the hub when a local
+    copy is given:
+      - dataset_path written by Dataset.save_to_disk is memory-mapped with load_from_disk;
+      - dataset_path holding .arrow files is memory-mapped with Dataset.from_file;
+      - dataset_path holding .parquet files is read with Dataset.from_parquet;
+      - cache_dir alone loads `name` from a pre-downloaded cache in offline mode.
+    Otherwise `name` is resolved on the hub as before.
+    """
+    if dataset_path or cache_dir:
+        # Must be set before datasets is imported for the first time.
+        os.environ.setdefault("HF_DATASETS_OFFLINE", "1")
+        os.environ.setdefault("HF_HUB_OFFLINE", "1")
+    from datasets import Dataset, DatasetDict, concatenate_datasets, load_dataset, load_from_disk
+
+    if not dataset_path:
+        return load_dataset(name, split=split, cache_dir=cache_dir)
+
+    if os.path.isdir(dataset_path) and (os.path.exists(os.path.join(dataset_path, "state.json")) or
+                                        os.path.exists(os.path.join(dataset_path, "dataset_dict.json"))):
+        dataset = load_from_disk(dataset_path)
+        return dataset[split] if isinstance(dataset, DatasetDict) else dataset
+
+    if os.path.isdir(dataset_path):
+        files = sorted(glob.glob(os.path.join(dataset_path, "**", "*"), recursive=True))
+        # Prefer files of the requested split when the directory holds several splits.
+        split_files = [f for f in files if split in os.path.basename(f)]
+        files = split_files or files
+    else:
+        files = [dataset_path]
+
+    arrow_files = [f for f in files if f.endswith(".arrow")]
+    if arrow_files:
+        return concatenate_datasets([Dataset.from_file(f) for f in arrow_files])
+    parquet_files = [f for f in files if f.endswith(".parquet")]
+    if parquet_files:
+        return Dataset.from_parquet(parquet_files, cache_dir=cache_dir)
+    raise ValueError(f"No save_to_disk dataset, .arrow or .parquet files found at {dataset_path}")
@@ -0,0 +1,76 @@
+import argparse
+import time
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from corpus_io import sidecar_parts
+
+def int_score_column(score_column):
+    # Same naming as run_single_file.py, which is not imported to avoid loading torch.
+    return score_column[:-len('score')] + 'int_score'
+
+def select_offsets(sidecar, score_column='score', min_score=None, max_score=None, min_int_score=None):
+    """Returns the byte offsets, scores and int_scores of the sidecar rows that pass the thresholds."""
+    int_column = int_score_column(score_column)
+    parts = sidecar_parts(sidecar)
+    if not parts:
+        raise FileNotFoundError(f"No committed sidecar parts in {sidecar}")
+    # Parts are read in commit order, which keeps the offsets ascending
+    table = pa.concat_tables([pq.read_table(part, columns=['offset', score_column, int_column]) for part in parts])
+    offsets = table.column('offset').to_numpy()
+    scores = table.column(score_column).to_numpy()
+    int_scores = table.column(int_column).to_numpy()
+
+    mask = np.ones(len(offsets), dtype=bool)
+    if min_score is not None:
+        mask &= scores >= min_score
+    if max_score is not None:
+        mask &= scores <= max_score
+    if min_int_score is not None:
+        mask &= int_scores >= min_int_score
+    return offsets[mask], scores[mask], int_scores[mask], len(offsets)
+
+def attach_scores(line, score, int_score, score_column='score'):
+    """Splices the scores into a raw JSON object line without decoding it."""
+    body = line.rstrip(b'\r\n').rstrip()
+    closing = body.rindex(b'}')
+    inner = body[:closing].rstrip()
+    separator = b'' if inner.endswith(b'{') else b', '
+    fields = f'"{score_column}": {float(score)}, "{int_score_column(score_column)}": {int(int_score)}'.encode('utf-8')
+    return inner + separator + fields + b'}\n'
+
+def main():
+    parser = argparse.ArgumentParser(description="Copy the documents selected by score thresholds in a run_single_file.py --sidecar file.")
+    parser.add_argument('--input_file', required=True, help='The jsonlines file that was scored.')
+    parser.add_argument('--sidecar', required=True, help='Directory of Parquet sidecar parts written by run_single_file.py --sidecar.')
+    parser.add_argument('--output_file', required=True, help='Path to the output jsonlines file.')
+    parser.add_argument('--score_column', default='score', help='Sidecar score column to filter on, e.g. ling_score. Its int column is derived from the name.')
+    parser.add_argument('--min_score', type=float, help='Minimum score to keep a document.')
+    parser.add_argument('--max_score', type=float, help='Maximum score to keep a document.')
+    parser.add_argument('--min_int_score', type=int, help='Minimum int_score to keep a document.')
+    parser.add_argument('--attach_scores', action='store_true', help='Add the score column and its int column to each copied document.')
+    args = parser.parse_args()
+
+    start_time = time.time()
+    offsets, scores, int_scores, total = select_offsets(args.sidecar, args.score_column, args.min_score, args.max_score, args.min_int_score)
+    print(f"Selected {len(offsets)} of {total} documents from {args.sidecar}")
+
+    with open(args.input_file, 'rb') as infile, open(args.output_file, 'wb') as outfile:
+        position = 0
+        for offset, score, int_score in zip(offsets.tolist(), scores.tolist(), int_scores.tolist()):
+            # Offsets are ascending, so consecutive selected lines need no seek.
+            if offset != position:
+                infile.seek(offset)
+            line = infile.readline()
+            position = offset + len(line)
+            if args.attach_scores:
+                line = attach_scores(line, score, int_score, args.score_column)
+            elif not line.endswith(b'\n'):
+                line += b'\n'
+            outfile.write(line)
+
+    print(f"Wrote {len(offsets)} documents to {args.output_file} in {time.time() - start_time:.1f} seconds")
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,18 @@
 import os
 import argparse
 import json
+import math
 import time
 from concurrent.futures import ProcessPoolExecutor
 import ftfy
 
+from corpus_io import base_name, open_text
+
 def fix_text(text):
     return ftfy.fix_text(text)
 
-def process_line(data, input_filename, id_prefix, id_counter, min_words, min_edu_score, min_ling_score, fix_text_flag):
-    try:
-        data = json.loads(data)
-    except json.JSONDecodeError:
-        print("JSONDecodeError")
-        return None
-
+def filter_record(data, input_filename, id_prefix, id_counter, min_words, min_edu_score, min_ling_score, fix_text_flag):
+    """Validates and filters one decoded record; returns the kept fields, or None to drop it."""
     # Validate and fix id
     if 'id' in data:
         if isinstance(data['id'], int):
@@ -39,6 +37,9 @@ def process_line(data, input_filename, id_prefix, id_counter, min_words, min_edu
         except ValueError:
             print("ValueError: Invalid score")
             return None
+    elif isinstance(data.get('edu_score'), (int, float)) and not math.isnan(data['edu_score']):
+        # Already standardised by standardise_corpus.py, which writes NaN for an unscored document
+        score = float(data['edu_score'])
     else:
         return None
 
@@ -48,7 +49,7 @@ def process_line(data, input_filename, id_prefix, id_counter, min_words, min_edu
         except ValueError:
             print("ValueError: Invalid int_score")
             return None
-    else:
+    elif 'score' in data:
         return None
 
     if 'ling_score' in data:
@@ -59,6 +60,8 @@ def process_line(data, input_filename, id_prefix, id_counter, min_words, min_edu
             return None
     else:
         ling_score = None
+    if ling_score is not None and math.isnan(ling_score):
+        ling_score = None
 
     if (min_edu_score is not None and score < min_edu_score) or (min_ling_score is not None and (ling_score is None or ling_score < min_ling_score)):
         return None
@@ -66,12 +69,12 @@ def process_line(data, input_filename, id_prefix, id_counter, min_words, min_edu
     data['edu_score'] = score
     if ling_score is not None:
         data['ling_score'] = ling_score
-    del data['score']
-    del data['int_score']
+    data.pop('score', None)
+    data.pop('int_score', None)
 
     # Validate doc_type
     if 'doc_type' not in data:
-        data['doc_type'] = os.path.splitext(os.path.basename(input_filename))[0]
+        data['doc_type'] = base_name(input_filename)
 
     # Only keep specific fields
     valid_data = {
@@ -83,7 +86,17 @@ def process_line(data, input_filename, id_prefix, id_counter, min_words, min_edu
     if ling_score is not None:
         valid_data['ling_score'] = ling_score
 
-    return json.dumps(valid_data)
+    return valid_data
+
+def process_line(data, input_filename, id_prefix, id_counter, min_words, min_edu_score, min_ling_score, fix_text_flag):
+    try:
+        data = json.loads(data)
+    except json.JSONDecodeError:
+        print("JSONDecodeError")
+        return None
+
+    valid_data = filter_record(data, input_filename, id_prefix, id_counter, min_words, min_edu_score, min_ling_score, fix_text_flag)
+    return None if valid_data is None else json.dumps(valid_data)
 
 def process_chunk(chunk, input_filename, id_prefix, id_counter, min_words, min_edu_score, min_ling_score, fix_text_flag):
     results = []
@@ -124,13 +137,13 @@ def main():
 
     input_filename = os.path.basename(args.input_file)
     output_filename = os.path.join(args.output_dir, input_filename)
-    id_prefix = f"{os.path.splitext(input_filename)[0]}_"
+    id_prefix = f"{base_name(input_filename)}_"
 
     id_counter = [1]
 
     print(f"Opening {args.input_file}")
 
-    with open(args.input_file, 'r') as infile, open(output_filename, 'w') as outfile:
+    with open_text(args.input_file) as infile, open_text(output_filename, 'w') as outfile:
         chunk_generator = read_in_chunks(infile, chunk_size=1000)
         
         with ProcessPoolExecutor(max_workers=num_cores) as executor:
@@ -4,6 +4,8 @@ import os
 import json
 import argparse
 
+from corpus_io import open_text
+
 publicnnewspaperurndict = {}
 
 def logerror(tag, msg):
@@ -37,6 +39,19 @@ def build_urn_from_id(doc_id: str) -> str:
         return ""
     return "digavis_" + "_".join(parts[:7])
 
+def keep_document(doc_id, doc_type) -> bool:
+    """Applies the licence rules below to one document."""
+    # 1) If doc_type == "newspaper_ocr", only keep it if its URN is public.
+    if doc_type == "newspaper_ocr":
+        return ispublicnewspaper(build_urn_from_id(doc_id))
+    # 2) If doc_type in ["newspapers_online_nb", "newspapers_online_nn"], always delete.
+    # 3) Otherwise, keep lines with other doc_types.
+    return doc_type not in ["newspapers_online_nb", "newspapers_online_nn"]
+
+def keep_record(data) -> bool:
+    """keep_document for a decoded record."""
+    return keep_document(data.get("id", "NO_ID"), data.get("doc_type", "NO_DOCTYPE"))
+
 def main():
     parser = argparse.ArgumentParser(
         description=(
@@ -56,8 +71,8 @@ def main():
     lines_deleted = 0
     lines_kept = 0
 
-    with open(args.input_file, "r", encoding="utf-8") as fp, \
-         open(args.output_file, "w", encoding="utf-8") as out_fp:
+    with open_text(args.input_file) as fp, \
+         open_text(args.output_file, "w") as out_fp:
 
         for line in fp:
             line_stripped = line.strip()
@@ -73,30 +88,12 @@ def main():
                 print("Deleted - INVALID_JSON - UNKNOWN_DOCTYPE")
                 continue
 
-            doc_id = data.get("id", "NO_ID")
-            doc_type = data.get("doc_type", "NO_DOCTYPE")
-
-            # 1) If doc_type == "newspaper_ocr", check URN in dictionary.
-            if doc_type == "newspaper_ocr":
-                urn = build_urn_from_id(doc_id)
-                if not ispublicnewspaper(urn):
-                    lines_deleted += 1
-                    #print(f"Deleted - {doc_id} - {doc_type}")
-                    continue
-                # Keep if URN is valid
-                out_fp.write(line_stripped + "\n")
-                lines_kept += 1
-
-            # 2) If doc_type in ["newspapers_online_nb", "newspapers_online_nn"], always delete.
-            elif doc_type in ["newspapers_online_nb", "newspapers_online_nn"]:
+            if not keep_record(data):
                 lines_deleted += 1
-                #print(f"Deleted - {doc_id} - {doc_type}")
+                #print(f"Deleted - {data.get('id', 'NO_ID')} - {data.get('doc_type', 'NO_DOCTYPE')}")
                 continue
-
-            # 3) Otherwise, keep lines with other doc_types.
-            else:
-                out_fp.write(line_stripped + "\n")
-                lines_kept += 1
+            out_fp.write(line_stripped + "\n")
+            lines_kept += 1
 
     print(f"Number of lines deleted: {lines_deleted}")
     print(f"Number of lines kept: {lines_kept}")
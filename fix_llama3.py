@@ -3,6 +3,9 @@ import re
 import json
 import argparse
 
+from corpus_io import open_text
+from chat_templates import BEGIN_OF_TEXT, END_OF_TEXT, EOT, START_HEADER
+
 def fix_prompt(text):
     """
     Fixes formatting issues in a Llama 3 prompt:
@@ -18,9 +21,9 @@ def fix_prompt(text):
     # Split text into lines and trim each line.
     lines = [line.strip() for line in text.splitlines()]
 
-    begin_token = "<|begin_of_text|>"
-    end_token = "<|end_of_text|>"
-    eot_token = "<|eot_id|>"
+    begin_token = BEGIN_OF_TEXT
+    end_token = END_OF_TEXT
+    eot_token = EOT
 
     # Check that the text is wrapped by the expected tokens.
     if not lines or lines[0] != begin_token or lines[-1] != end_token:
@@ -40,7 +43,7 @@ def fix_prompt(text):
 
     for line in inner_lines:
         # A new message block starts when a line begins with <|start_header_id|>
-        if line.startswith("<|start_header_id|>"):
+        if line.startswith(START_HEADER):
             if block:
                 fixed_lines.extend(flush_block(block))
                 block = []
@@ -60,8 +63,8 @@ def process_file(input_file, output_file):
     Processes a JSONL file, fixing the 'text' field for each JSON object,
     and writes corrected entries to the output file.
     """
-    with open(input_file, "r", encoding="utf-8") as infile, \
-         open(output_file, "w", encoding="utf-8") as outfile:
+    with open_text(input_file) as infile, \
+         open_text(output_file, "w") as outfile:
         for line in infile:
             try:
                 data = json.loads(line)
@@ -1,12 +1,14 @@
 import json
 import argparse
 
+from corpus_io import open_text
+
 def process_file(input_file, output_file, min_translation_score, verbose):
     total_valid_entries = 0
     total_errors = 0
     low_translation_score_count = 0
 
-    with open(input_file, 'r', encoding='utf-8') as infile, open(output_file, 'w', encoding='utf-8') as outfile:
+    with open_text(input_file) as infile, open_text(output_file, 'w') as outfile:
         for index, line in enumerate(infile):
             try:
                 data = json.loads(line)
@@ -2,6 +2,8 @@ import argparse
 import json
 from transformers import AutoTokenizer
 
+from corpus_io import open_text
+
 def process_file(input_file, output_file):
     tokenizer = AutoTokenizer.from_pretrained("north/llama3-8b-reference")
     max_tokens = 128000
@@ -12,10 +14,10 @@ def process_file(input_file, output_file):
     current_tokens_count = 0
 
     def write_jsonl(id_list, text):
-        with open(output_file, 'a', encoding='utf-8') as out_f:
+        with open_text(output_file, 'a') as out_f:
             out_f.write(json.dumps({"id": "__".join(id_list), "text": text}) + "\n")
 
-    with open(input_file, 'r', encoding='utf-8') as f:
+    with open_text(input_file) as f:
         for line in f:
             data = json.loads(line)
             text = data.get('text', '')
@@ -1,59 +1,119 @@
 import argparse
-import pandas as pd
 import json
 import asciichartpy as ac
 import matplotlib.pyplot as plt
 import os
 import numpy as np
-
-def read_scores_from_jsonl(file_path):
-    scores = []
-    with open(file_path, 'r') as f:
-        for line in f:
-            data = json.loads(line)
-            if 'score' in data:
-                score = data['score']
-                if score < 0:
-                    score = 0
-                scores.append(score)
-    return scores
-
-def plot_histogram(scores, save_path=None):
-    # Create a DataFrame from the scores
-    df = pd.DataFrame(scores, columns=['score'])
-
-    # Plot the histogram with fixed bins of 0.1 from 0 to 5
-    bins = np.linspace(0, 5, 51)
-    plt.hist(df['score'], bins=bins, edgecolor='black', alpha=0.7)
+from concurrent.futures import ProcessPoolExecutor
+
+from corpus_io import base_name, iter_column_batches
+
+# Fixed bins of 0.1 from 0 to 5
+BINS = np.linspace(0, 5, 51)
+# Bins of 0.001 used to estimate quantiles; the estimate is exact to one bin width.
+FINE_BINS = np.linspace(0, 5, 5001)
+QUANTILES = [0.1, 0.25, 0.5, 0.75, 0.9, 0.99]
+
+class ScoreStats:
+    """
+    Mergeable single-pass summary of a score stream: fixed-bin counts, count,
+    mean, variance (Chan et al.'s parallel update), min/max and fine-bin counts
+    for quantiles. Memory does not grow with the number of scores.
+    """
+
+    def __init__(self):
+        self.counts = np.zeros(len(BINS) - 1, dtype=np.int64)
+        self.fine_counts = np.zeros(len(FINE_BINS) - 1, dtype=np.int64)
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = float('inf')
+        self.max = float('-inf')
+
+    def _merge_moments(self, n, mean, m2):
+        if n == 0:
+            return
+        total = self.n + n
+        delta = mean - self.mean
+        self.mean += delta * n / total
+        self.m2 += m2 + delta * delta * self.n * n / total
+        self.n = total
+
+    def add(self, scores):
+        scores = np.asarray(scores, dtype=np.float64)
+        if not len(scores):
+            return
+        self.counts += np.histogram(scores, bins=BINS)[0]
+        self.fine_counts += np.histogram(scores, bins=FINE_BINS)[0]
+        mean = scores.mean()
+        self._merge_moments(len(scores), mean, float(((scores - mean) ** 2).sum()))
+        self.min = min(self.min, float(scores.min()))
+        self.max = max(self.max, float(scores.max()))
+
+    def merge(self, other):
+        self.counts += other.counts
+        self.fine_counts += other.fine_counts
+        self._merge_moments(other.n, other.mean, other.m2)
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    @property
+    def variance(self):
+        return self.m2 / self.n if self.n else 0.0
+
+    def quantile(self, q):
+        """Linear interpolation inside the fine bin holding the q-th score (scores above 5 are not binned)."""
+        total = self.fine_counts.sum()
+        if not total:
+            return None
+        cumulative = np.cumsum(self.fine_counts)
+        target = q * total
+        idx = int(np.searchsorted(cumulative, target))
+        below = cumulative[idx - 1] if idx > 0 else 0
+        fraction = (target - below) / self.fine_counts[idx] if self.fine_counts[idx] else 0.0
+        return float(FINE_BINS[idx] + fraction * (FINE_BINS[idx + 1] - FINE_BINS[idx]))
+
+def read_score_stats(file_path, score_column='score', chunk_size=100000):
+    """Summarises one JSONL or Parquet file; Parquet files only read the score column."""
+    stats = ScoreStats()
+    for batch in iter_column_batches(file_path, [score_column], chunk_size):
+        scores = np.array([score for score in batch[score_column] if score is not None], dtype=np.float64)
+        # Negative scores count as 0; NaN marks a missing score in the standardised corpus
+        stats.add(np.maximum(scores[~np.isnan(scores)], 0))
+    return stats
+
+def plot_histogram(stats, save_path=None):
+    # The counts are already binned, so plot each bin once weighted by its count
+    plt.hist(BINS[:-1], bins=BINS, weights=stats.counts, edgecolor='black', alpha=0.7)
     plt.title('Score Histogram')
     plt.xlabel('Score')
     plt.ylabel('Frequency')
     plt.grid(True)
-    
+
     if save_path:
         plt.savefig(save_path)
         print(f"Image is saved to {save_path}")
     else:
         plt.show()
 
-def plot_histogram_ascii(scores):
-    # Create histogram data with fixed bins of 0.1 from 0 to 5
-    bins = np.linspace(0, 5, 51)
-    counts, _ = np.histogram(scores, bins=bins)
-
+def plot_histogram_ascii(stats):
     # Generate the ASCII histogram
-    chart = ac.plot(counts.tolist(), {'height': 20})
+    chart = ac.plot(stats.counts.tolist(), {'height': 20})
 
     print(chart)
 
-def save_bin_counts(scores, save_path):
-    # Create histogram data with fixed bins of 0.1 from 0 to 5
-    bins = np.linspace(0, 5, 51)
-    counts, bin_edges = np.histogram(scores, bins=bins)
+def print_summary(stats):
+    print(f"Scores: {stats.n}")
+    if not stats.n:
+        return
+    print(f"Mean: {stats.mean:.4f}  Std: {np.sqrt(stats.variance):.4f}  Min: {stats.min:.4f}  Max: {stats.max:.4f}")
+    print("  ".join(f"p{int(q * 100)}: {stats.quantile(q):.3f}" for q in QUANTILES))
 
+def save_bin_counts(stats, save_path):
     # Prepare the JSONL data
-    bin_data = [{"bin_start": float(bin_edges[i]), "bin_end": float(bin_edges[i+1]), "count": int(count)}
-                for i, count in enumerate(counts)]
+    bin_data = [{"bin_start": float(BINS[i]), "bin_end": float(BINS[i+1]), "count": int(count)}
+                for i, count in enumerate(stats.counts)]
 
     # Save the bin counts to a JSONL file
     with open(save_path, 'w') as f:
@@ -62,18 +122,26 @@ def save_bin_counts(scores, save_path):
     print(f"Bin counts saved to {save_path}")
 
 def main():
-    parser = argparse.ArgumentParser(description="Plot histogram of scores from JSONL file")
-    parser.add_argument('--input_file', type=str, required=True, help='Path to the input JSONL file')
+    parser = argparse.ArgumentParser(description="Plot histogram of scores from JSONL files")
+    parser.add_argument('--input_file', type=str, required=True, nargs='+', help='Path to one or more input JSONL or Parquet files')
+    parser.add_argument('--score_column', type=str, default='score', help='Column holding the score, e.g. edu_score in the standardised corpus')
     parser.add_argument('--ascii', action='store_true', help='Output histogram as ASCII art')
     parser.add_argument('--save_dir', type=str, help='Directory to save the histogram image and bin counts')
+    parser.add_argument('--max_cpu_count', type=int, default=48, help='Maximum number of files read concurrently')
     args = parser.parse_args()
 
-    # Read scores from the JSONL file
-    scores = read_scores_from_jsonl(args.input_file)
+    # Read every file into its own summary in parallel and merge them
+    num_workers = max(1, min(os.cpu_count(), args.max_cpu_count, len(args.input_file)))
+    stats = ScoreStats()
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        for file_stats in executor.map(read_score_stats, args.input_file, [args.score_column] * len(args.input_file)):
+            stats.merge(file_stats)
+
+    print_summary(stats)
 
     # Plot the ASCII histogram if requested
     if args.ascii:
-        plot_histogram_ascii(scores)
+        plot_histogram_ascii(stats)
 
     # Determine save paths if provided
     image_save_path = None
@@ -81,16 +149,19 @@ def main():
     if args.save_dir:
         if not os.path.exists(args.save_dir):
             os.makedirs(args.save_dir)
-        file_name = os.path.splitext(os.path.basename(args.input_file))[0]
+        if len(args.input_file) == 1:
+            file_name = base_name(args.input_file[0])
+        else:
+            file_name = 'combined'
         image_save_path = os.path.join(args.save_dir, file_name + '.png')
         jsonl_save_path = os.path.join(args.save_dir, file_name + '.jsonl')
 
     # Plot the matplotlib histogram and save if save_path is set
-    plot_histogram(scores, image_save_path)
+    plot_histogram(stats, image_save_path)
 
     # Save the bin counts to a JSONL file if save_path is set
     if jsonl_save_path:
-        save_bin_counts(scores, jsonl_save_path)
+        save_bin_counts(stats, jsonl_save_path)
 
 if __name__ == '__main__':
     main()
@@ -5,6 +5,8 @@ import sys
 from pathlib import Path
 from collections import defaultdict
 
+from corpus_io import open_text
+
 def debug_print(*args, **kwargs):
     print(*args, **kwargs)
     sys.stdout.flush()
@@ -73,6 +75,47 @@ def find_fifth_punctuation(text):
                 return idx + 1  # Include the punctuation
     return None
 
+FORMATTERS = {
+    'gemma': format_gemma,
+    'gemma2': format_gemma2,
+    'llama3': format_llama3
+}
+
+def format_document(doc, templates, formatter, rng=random):
+    """
+    Splits one document into a prompt and a continuation and formats it with a
+    random template. Returns (new_doc, 'success'), or (None, reason) when the
+    document is skipped.
+    """
+    if 'text' not in doc:
+        return None, 'missing_text'
+
+    original_text = doc['text']
+    first_para, rest = "", ""
+
+    # Try newline split first
+    if '\n' in original_text:
+        parts = original_text.split('\n', 1)
+        first_para = parts[0].strip()
+        rest = parts[1].strip() if len(parts) > 1 else ""
+    else:
+        # Try punctuation split if no newline
+        split_pos = find_fifth_punctuation(original_text)
+        if not split_pos:
+            return None, 'no_split'
+        first_para = original_text[:split_pos].strip()
+        rest = original_text[split_pos:].strip()
+
+    # Validate word counts
+    words_before = len(first_para.split())
+    words_after = len(rest.split())
+    if words_before < 8 or words_after < 20:
+        return None, 'word_count'
+
+    selected_template = rng.choice(templates)
+    new_text = formatter(selected_template, first_para, rest)
+    return {**doc, "text": new_text}, 'success'
+
 def process_documents(template_path, input_path, output_path, template_format):
     stats = defaultdict(int)
     try:
@@ -82,19 +125,14 @@ def process_documents(template_path, input_path, output_path, template_format):
             sys.exit(1)
             
         templates = load_templates(template_path)
-        formatters = {
-            'gemma': format_gemma,
-            'gemma2': format_gemma2,
-            'llama3': format_llama3
-        }
-        formatter = formatters[template_format]
+        formatter = FORMATTERS[template_format]
         
         debug_print(f"📂 Preparing output directory: {output_path.parent}")
         output_path.parent.mkdir(parents=True, exist_ok=True)
         
         processed = 0
-        with open(input_path, 'r', encoding='utf-8') as infile, \
-             open(output_path, 'w', encoding='utf-8') as outfile:
+        with open_text(str(input_path)) as infile, \
+             open_text(str(output_path), 'w') as outfile:
             
             debug_print(f"🚀 Starting processing with format '{template_format}'")
             for line_num, line in enumerate(infile, 1):
@@ -104,57 +142,18 @@ def process_documents(template_path, input_path, output_path, template_format):
                         continue
                         
                     doc = json.loads(line)
-                    if 'text' not in doc:
-                        stats['missing_text'] += 1
-                        debug_print(f"⚠️  Missing 'text' field in line {line_num}")
+                    new_doc, status = format_document(doc, templates, formatter)
+                    stats[status] += 1
+                    if new_doc is None:
+                        if status == 'missing_text':
+                            debug_print(f"⚠️  Missing 'text' field in line {line_num}")
                         continue
-                        
-                    original_text = doc['text']
-                    first_para, rest = "", ""
-                    valid = False
-                    split_method = ""
-
-                    # Try newline split first
-                    if '\n' in original_text:
-                        parts = original_text.split('\n', 1)
-                        first_para = parts[0].strip()
-                        rest = parts[1].strip() if len(parts) > 1 else ""
-                        split_method = "newline"
-                    else:
-                        # Try punctuation split if no newline
-                        split_pos = find_fifth_punctuation(original_text)
-                        if split_pos:
-                            first_para = original_text[:split_pos].strip()
-                            rest = original_text[split_pos:].strip()
-                            split_method = "punctuation"
-                        else:
-                            stats['no_split'] += 1
-                            #debug_print(f"⚠️  Line {line_num}: No valid split found")
-                            continue
-
-                    # Validate word counts
-                    words_before = len(first_para.split())
-                    words_after = len(rest.split())
-                    
-                    if words_before >= 8 and words_after >= 20:
-                        valid = True
-                    else:
-                        stats['word_count'] += 1
-                        #debug_print(f"⚠️  Line {line_num}: Invalid word counts "
-                        #          f"({words_before} before, {words_after} after)")
-                        continue
-                    
-                    if valid:
-                        selected_template = random.choice(templates)
-                        new_text = formatter(selected_template, first_para, rest)
-                        
-                        new_doc = {**doc, "text": new_text}
-                        outfile.write(json.dumps(new_doc, ensure_ascii=False) + '\n')
-                        processed += 1
-                        stats['success'] += 1
-                        
-                        if processed % 100000 == 0:
-                            debug_print(f"📦 Processed {processed} documents...")
+
+                    outfile.write(json.dumps(new_doc, ensure_ascii=False) + '\n')
+                    processed += 1
+
+                    if processed % 100000 == 0:
+                        debug_print(f"📦 Processed {processed} documents...")
                         
                 except Exception as e:
                     stats['other'] += 1
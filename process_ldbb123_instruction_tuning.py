@@ -1,62 +1,71 @@
 import argparse
 import json
 import os
-import random
 from tqdm import tqdm
 
-def load_jsonl_files(dataset_path):
-    data = []
-    for filename in os.listdir(dataset_path):
-        if filename.endswith('.jsonl'):
-            with open(os.path.join(dataset_path, filename), 'r', encoding='utf-8') as file:
-                for line in file:
-                    try:
-                        data.append(json.loads(line))
-                    except json.JSONDecodeError as e:
-                        print(f"Skipping line in {filename} due to JSON decode error: {e}")
-    return data
+from corpus_io import list_jsonl_files, open_text
+from few_shot import disjoint_shots, random_shots, sliding_shots
 
-def process_dataset(output_file, num_shots, dataset_path):
-    # Load the dataset manually from JSONL files
-    print("Loading dataset...")
-    data = load_jsonl_files(dataset_path)
-    print("Loaded dataset. Total records:", len(data))
-    
-    with open(output_file, 'w', encoding='utf-8') as f:
-        for i in tqdm(range(0, len(data)), desc="Processing dataset"):
-            num_shots_actual = random.randint(1, 9) if num_shots is None else num_shots
-            indices = range(i, min(i + num_shots_actual, len(data)))
-            
-            text_parts = []
-            for idx in indices:
+def iter_jsonl_files(dataset_path):
+    for filepath in list_jsonl_files(dataset_path):
+        with open_text(filepath) as file:
+            for line in file:
                 try:
-                    instruction = data[idx]['instruction']
-                    input_text = data[idx]['input']
-                    output = data[idx]['output']
-                    
-                    combined_text = f"{instruction} {input_text}\n\n{output}".strip()
-                    text_parts.append(f"\"{combined_text}\"")
-                except KeyError as e:
-                    print(f"Skipping record {idx} due to missing column: {e}")
-                    continue
-                except Exception as e:
-                    print(f"Skipping record {idx} due to error: {e}")
-                    continue
+                    yield json.loads(line)
+                except json.JSONDecodeError as e:
+                    print(f"Skipping line in {os.path.basename(filepath)} due to JSON decode error: {e}")
+
+def format_examples(records):
+    """Formats each record once; records with missing columns are skipped here, not per window."""
+    for idx, record in enumerate(records):
+        try:
+            instruction = record['instruction']
+            input_text = record['input']
+            output = record['output']
             
-            if text_parts:
-                text = "\n\n".join(text_parts)
-                record = {
-                    "source": "ldbb123/Instruction-tuning_Datasets",
-                    "num_shots": num_shots_actual,
-                    "text": text
-                }
-                f.write(json.dumps(record) + '\n')
+            combined_text = f"{instruction} {input_text}\n\n{output}".strip()
+            yield f"\"{combined_text}\""
+        except KeyError as e:
+            print(f"Skipping record {idx} due to missing column: {e}")
+            continue
+        except Exception as e:
+            print(f"Skipping record {idx} due to error: {e}")
+            continue
+
+def make_groups(examples, grouping, num_shots, stride, pool_size):
+    if grouping == "sliding":
+        return sliding_shots(examples, num_shots, stride=stride)
+    if grouping == "random":
+        return random_shots(examples, num_shots, pool_size=pool_size)
+    return disjoint_shots(examples, num_shots)
+
+def process_dataset(output_file, num_shots, dataset_path, grouping="disjoint", stride=1, pool_size=10000):
+    # Stream the dataset from the JSONL files; each example is formatted once
+    print("Streaming dataset...")
+    examples = format_examples(iter_jsonl_files(dataset_path))
+    
+    with open_text(output_file, 'w') as f:
+        for num_shots_actual, text_parts in tqdm(make_groups(examples, grouping, num_shots, stride, pool_size), desc="Processing dataset"):
+            text = "\n\n".join(text_parts)
+            record = {
+                "source": "ldbb123/Instruction-tuning_Datasets",
+                "num_shots": num_shots_actual,
+                "text": text
+            }
+            f.write(json.dumps(record) + '\n')
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Process ldbb123 Instruction-tuning Datasets and convert to JSONLines format.')
     parser.add_argument('--output_file', type=str, required=True, help='Path to the output JSONLines file')
     parser.add_argument('--num_shots', type=int, choices=range(1, 100), help='Number of examples to include in each text field, between 1 and 99. If not set, a random number between 1 and 9 will be used.')
     parser.add_argument('--dataset_path', type=str, required=True, help='Path to the downloaded dataset JSONL files')
+    parser.add_argument('--grouping', type=str, choices=['disjoint', 'sliding', 'random'], default='disjoint', help='How examples are grouped: "disjoint" consecutive groups, "sliding" windows every --stride examples, or "random" groups drawn from a pool of upcoming examples. Disjoint and random use each example once.')
+    parser.add_argument('--stride', type=int, default=1, help='Step between window starts for --grouping sliding. A stride of 1 gives one overlapping record per example.')
+    parser.add_argument('--pool_size', type=int, default=10000, help='Number of upcoming examples to sample from for --grouping random.')
 
     args = parser.parse_args()
-    process_dataset(args.output_file, args.num_shots, args.dataset_path)
+    if args.stride < 1:
+        parser.error('--stride must be at least 1.')
+    if args.pool_size < 1:
+        parser.error('--pool_size must be at least 1.')
+    process_dataset(args.output_file, args.num_shots, args.dataset_path, args.grouping, args.stride, args.pool_size)
@@ -2,6 +2,8 @@ import argparse
 import json
 from tqdm import tqdm
 
+from corpus_io import open_text
+
 def sanitize_json_string(json_string):
     # Remove leading/trailing newlines or spaces
     json_string = json_string.strip()
@@ -33,25 +35,25 @@ def recursive_parse_json(json_data):
         return {key: recursive_parse_json(value) for key, value in json_data.items()}
     return json_data
 
-def process_dataset(input_file, output_file, verbose, minimum_translation_score):
-    print("Loading dataset...")
-    data = []
-    with open(input_file, 'r', encoding='utf-8') as f:
+def read_records(input_file, verbose):
+    with open_text(input_file) as f:
         for line in f:
             try:
-                data.append(json.loads(line))
+                yield json.loads(line)
             except json.JSONDecodeError as e:
                 if verbose:
                     print(f"Skipping line due to JSON decode error: {e}")
                     print(f"Offending line: {line}")
                 continue
 
-    print("Loaded dataset. Total records:", len(data))
+def process_dataset(input_file, output_file, verbose, minimum_translation_score):
+    # Stream the dataset instead of loading it into memory
+    print("Streaming dataset...")
     
     skipped_records = 0
 
-    with open(output_file, 'w', encoding='utf-8') as f:
-        for record in tqdm(data, desc="Processing dataset"):
+    with open_text(output_file, 'w') as f:
+        for record in tqdm(read_records(input_file, verbose), desc="Processing dataset"):
             try:
                 askLLMresult = record.get('askLLMresult', '')
 
@@ -2,21 +2,22 @@ import argparse
 import json
 from tqdm import tqdm
 
-def process_dataset(input_file, output_file):
-    # Load the dataset
-    print("Loading dataset...")
-    data = []
-    with open(input_file, 'r', encoding='utf-8') as f:
+from corpus_io import open_text
+
+def read_records(input_file):
+    with open_text(input_file) as f:
         for line in f:
             try:
-                data.append(json.loads(line))
+                yield json.loads(line)
             except json.JSONDecodeError as e:
                 print(f"Skipping line due to JSON decode error: {e}")
+
+def process_dataset(input_file, output_file):
+    # Stream the dataset instead of loading it into memory
+    print("Streaming dataset...")
     
-    print("Loaded dataset. Total records:", len(data))
-    
-    with open(output_file, 'w', encoding='utf-8') as f:
-        for record in tqdm(data, desc="Processing dataset"):
+    with open_text(output_file, 'w') as f:
+        for record in tqdm(read_records(input_file), desc="Processing dataset"):
             try:
                 text = record['text']
                 askLLMresult = record['askLLMresult']
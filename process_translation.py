@@ -1,32 +1,40 @@
 import argparse
 import json
-import random
 from tqdm import tqdm
 
-def process_dataset(input_file, output_file, direction, max_distance, num_shots):
-    # Load the dataset
-    print("Loading dataset...")
-    data = []
-    with open(input_file, 'r', encoding='utf-8') as f:
+from corpus_io import open_text
+from few_shot import disjoint_shots
+
+def read_filtered_records(input_file, max_distance, counts):
+    with open_text(input_file) as f:
         for line in f:
             record = json.loads(line)
-            if record['semantic_distance'] <= max_distance:
-                data.append(record)
-    
-    print("Loaded dataset. Total records after filtering:", len(data))
+            # Pairs flagged by calculate_distance_convert_jsonlines.py's number check are never used.
+            if record.get('number_mismatch'):
+                continue
+            # Output of --only_number_check has no distance, so there is nothing to filter on
+            if 'semantic_distance' not in record:
+                counts['no_distance'] += 1
+                yield record
+            elif record['semantic_distance'] <= max_distance:
+                yield record
+
+def process_dataset(input_file, output_file, direction, max_distance, num_shots):
+    # Stream the dataset; only the current few-shot window is held in memory
+    print("Streaming dataset...")
+    counts = {'no_distance': 0}
+    records = enumerate(read_filtered_records(input_file, max_distance, counts))
     
-    with open(output_file, 'w', encoding='utf-8') as f:
-        i = 0
-        while i < len(data):
-            num_shots_actual = random.randint(1, 9) if num_shots is None else num_shots
-            indices = range(i, min(i + num_shots_actual, len(data)))
-            i += num_shots_actual
+    with open_text(output_file, 'w') as f:
+        total_records = 0
+        for num_shots_actual, window in disjoint_shots(records, num_shots):
+            total_records += len(window)
             
             text_parts = []
-            for idx in indices:
+            for idx, example in window:
                 try:
-                    norwegian = data[idx]['norwegian']
-                    english = data[idx]['english']
+                    norwegian = example['norwegian']
+                    english = example['english']
                     
                     if direction == "enno":
                         combined_text = f'Translate the following text from English to Norwegian: "{english}" {norwegian}'
@@ -51,6 +59,10 @@ def process_dataset(input_file, output_file, direction, max_distance, num_shots)
                     "text": text
                 }
                 f.write(json.dumps(record) + '\n')
+    
+    print("Processed dataset. Total records after filtering:", total_records)
+    if counts['no_distance']:
+        print(f"{counts['no_distance']} records had no semantic_distance (number check only) and were not filtered on distance.")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Process a translation dataset and convert to JSONLines format.')
@@ -1,50 +1,29 @@
 import argparse
-import json
-import random
-from tqdm import tqdm
-from datasets import load_dataset
 
-def process_dataset(output_file, num_shots):
+from few_shot import load_hf_dataset, write_few_shot_dataset
+
+def format_example(summary, full_text):
+    return f'Please summarize the following text: "{full_text}"\n\n{summary}'.strip()
+
+def process_dataset(output_file, num_shots, batch_size=10000, num_proc=None, dataset_path=None, cache_dir=None):
     # Load the dataset
     print("Loading dataset...")
-    dataset = load_dataset("jordiclive/wikipedia-summary-dataset", split='train')
+    dataset = load_hf_dataset("jordiclive/wikipedia-summary-dataset", dataset_path, cache_dir)
     print("Loaded dataset. Total records:", len(dataset))
     
-    with open(output_file, 'w', encoding='utf-8') as f:
-        i = 0
-        while i < len(dataset):
-            num_shots_actual = random.randint(1, 3) if num_shots is None else num_shots
-            indices = range(i, min(i + num_shots_actual, len(dataset)))
-            i += num_shots_actual
-            
-            text_parts = []
-            for idx in indices:
-                try:
-                    summary = dataset[idx]['summary']
-                    full_text = dataset[idx]['full_text']
-                    
-                    combined_text = f'Please summarize the following text: "{full_text}"\n\n{summary}'.strip()
-                    text_parts.append(combined_text)
-                except KeyError as e:
-                    print(f"Skipping record {idx} due to missing column: {e}")
-                    continue
-                except Exception as e:
-                    print(f"Skipping record {idx} due to error: {e}")
-                    continue
-            
-            if text_parts:
-                text = "\n\n".join(text_parts)
-                record = {
-                    "source": "jordiclive/wikipedia-summary-dataset",
-                    "num_shots": num_shots_actual,
-                    "text": text
-                }
-                f.write(json.dumps(record) + '\n')
+    # Few-shot texts are assembled from Arrow column batches, not row by row
+    write_few_shot_dataset(dataset, ['summary', 'full_text'], format_example, output_file,
+                           source="jordiclive/wikipedia-summary-dataset", num_shots=num_shots, max_shots=3,
+                           batch_size=batch_size, num_proc=num_proc)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Process jordiclive/wikipedia-summary-dataset and convert to JSONLines format.')
     parser.add_argument('--output_file', type=str, required=True, help='Path to the output JSONLines file')
     parser.add_argument('--num_shots', type=int, choices=range(1, 4), help='Number of examples to include in each text field, between 1 and 3. If not set, a random number between 1 and 3 will be used.')
+    parser.add_argument('--batch_size', type=int, default=10000, help='Number of rows decoded per Arrow record batch')
+    parser.add_argument('--num_proc', type=int, help='Number of processes for building the few-shot texts with Dataset.map')
+    parser.add_argument('--dataset_path', type=str, help='Local copy of the dataset (save_to_disk directory, or .arrow/.parquet files). Loaded memory-mapped without hub access')
+    parser.add_argument('--cache_dir', type=str, help='Pre-downloaded Hugging Face cache to load the dataset from in offline mode')
 
     args = parser.parse_args()
-    process_dataset(args.output_file, args.num_shots)
+    process_dataset(args.output_file, args.num_shots, args.batch_size, args.num_proc, args.dataset_path, args.cache_dir)
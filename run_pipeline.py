@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+"""
+Runs a chain of corpus processing stages over one file in a single pass.
+
+Each stage is the record-level function of one of the stand-alone scripts,
+applied to the decoded record in memory, so the corpus is parsed once,
+serialised once and no intermediate files are written. The chain is given
+as a JSON config, for example the production flow:
+
+    {
+      "seed": 42,
+      "stages": [
+        {"stage": "concatenate_paragraphs"},
+        {"stage": "standardise_corpus"},
+        {"stage": "filter_dataset", "min_words": 10, "min_edu_score": 3},
+        {"stage": "filter_legal_newspapers"},
+        {"stage": "process_document", "templates": "templates/template.jsonl", "format": "llama3"}
+      ]
+    }
+
+Stage options are the command line options of the script. Names derived
+from the input file (doc_type, id prefixes) are taken from --input_file, as if
+every stage had been run on a file of that name. Chunks of lines are processed
+on a process pool and written in input order. With a seed, process_document
+picks the same templates on every run, though not the same ones as
+process_document.py itself. The number of records each stage received,
+kept and dropped, with the reasons, is reported at the end.
+"""
+
+import argparse
+import json
+import os
+import random
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+
+from corpus_io import base_name, open_text
+
+def build_concatenate_paragraphs(options, input_file):
+    from concatenate_paragraphs import concatenate_record
+
+    def stage(record, idx, rng):
+        return concatenate_record(record), None
+    return stage
+
+def build_standardise_corpus(options, input_file):
+    from standardise_corpus import standardise_record
+    doc_type = base_name(input_file)
+
+    def stage(record, idx, rng):
+        return standardise_record(record, idx, doc_type), None
+    return stage
+
+def build_filter_dataset(options, input_file):
+    from filter_dataset import filter_record
+    input_filename = os.path.basename(input_file)
+    id_prefix = f"{base_name(input_filename)}_"
+    id_counter = [1]
+    settings = (options.get("min_words", 10), options.get("min_edu_score"), options.get("min_ling_score"),
+                options.get("fix_text", False))
+
+    def stage(record, idx, rng):
+        record = filter_record(record, input_filename, id_prefix, id_counter, *settings)
+        return record, None if record is not None else "filtered"
+    return stage
+
+def build_filter_legal_newspapers(options, input_file):
+    from filter_legal_newspapers import keep_record, readpublicnewspaperurnfile
+    readpublicnewspaperurnfile()
+
+    def stage(record, idx, rng):
+        return (record, None) if keep_record(record) else (None, "licence")
+    return stage
+
+def build_process_document(options, input_file):
+    from process_document import FORMATTERS, format_document, load_templates
+    if "templates" not in options:
+        raise ValueError("process_document needs a templates file")
+    templates = load_templates(options["templates"])
+    formatter = FORMATTERS[options.get("format", "gemma")]
+
+    def stage(record, idx, rng):
+        try:
+            record, status = format_document(record, templates, formatter, rng)
+        except Exception:
+            return None, "other"
+        return record, None if record is not None else status
+    return stage
+
+STAGES = {
+    "concatenate_paragraphs": (build_concatenate_paragraphs, set()),
+    "standardise_corpus": (build_standardise_corpus, set()),
+    "filter_dataset": (build_filter_dataset, {"min_words", "min_edu_score", "min_ling_score", "fix_text"}),
+    "filter_legal_newspapers": (build_filter_legal_newspapers, set()),
+    "process_document": (build_process_document, {"templates", "format"}),
+}
+
+def validate_config(config):
+    """Raises ValueError for an unknown stage or option."""
+    unknown = set(config) - {"seed", "stages"}
+    if unknown:
+        raise ValueError(f"Unknown config keys {', '.join(sorted(unknown))}")
+    if not config.get("stages"):
+        raise ValueError("The config has no stages")
+    for position, options in enumerate(config["stages"], start=1):
+        name = options.get("stage")
+        if name not in STAGES:
+            raise ValueError(f"Stage {position}: unknown stage {name!r}, expected one of {', '.join(STAGES)}")
+        unknown = set(options) - STAGES[name][1] - {"stage"}
+        if unknown:
+            raise ValueError(f"Stage {position} ({name}): unknown options {', '.join(sorted(unknown))}")
+
+def build_chain(config, input_file):
+    return [STAGES[options["stage"]][0](options, input_file) for options in config["stages"]]
+
+_chain = None
+_seed = None
+
+def _init_worker(config, input_file):
+    global _chain, _seed
+    _chain = build_chain(config, input_file)
+    _seed = config.get("seed")
+
+def run_chunk(start, lines):
+    """
+    Runs the chain over lines, the first of which is line start of the input.
+    Returns the serialised output lines, a Counter per stage and the number
+    of lines that could not be decoded.
+    """
+    # Seeded by position, so the result does not depend on which worker gets the chunk
+    rng = random.Random(f"{_seed}:{start}") if _seed is not None else random.Random()
+    counts = [Counter() for _ in _chain]
+    invalid_json = 0
+    output = []
+    for idx, line in enumerate(lines, start):
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            invalid_json += 1
+            continue
+        for stage, stage_counts in zip(_chain, counts):
+            stage_counts["in"] += 1
+            record, reason = stage(record, idx, rng)
+            if record is None:
+                stage_counts[reason] += 1
+                break
+            stage_counts["kept"] += 1
+        else:
+            output.append(json.dumps(record, ensure_ascii=False))
+    return output, counts, invalid_json
+
+def read_in_chunks(file_object, chunk_size=1000):
+    """Yields (index of the first line, lines)."""
+    chunk = []
+    start = 0
+    for idx, line in enumerate(file_object):
+        if not chunk:
+            start = idx
+        chunk.append(line)
+        if len(chunk) >= chunk_size:
+            yield start, chunk
+            chunk = []
+    if chunk:
+        yield start, chunk
+
+def print_report(config, counts, invalid_json, written, elapsed):
+    print(f"Wrote {written} documents in {elapsed:.1f} seconds")
+    if invalid_json:
+        print(f"Skipped {invalid_json} lines that are not valid JSON (including empty lines)")
+    for options, stage_counts in zip(config["stages"], counts):
+        dropped = {reason: count for reason, count in stage_counts.items() if reason not in ("in", "kept")}
+        line = f"- {options['stage']}: {stage_counts['in']} in, {stage_counts['kept']} kept"
+        if dropped:
+            line += ", dropped " + ", ".join(f"{reason} {count}" for reason, count in sorted(dropped.items(), key=lambda item: -item[1]))
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a chain of processing stages over a jsonlines file without intermediate files.")
+    parser.add_argument("--config", required=True, help="JSON file with the stages to run, in order.")
+    parser.add_argument("--input_file", required=True, help="Path to the input jsonlines file.")
+    parser.add_argument("--output_file", required=True, help="Path to the output jsonlines file.")
+    parser.add_argument("--chunk_size", type=int, default=1000, help="Lines per worker task.")
+    parser.add_argument("--max_cpu_count", type=int, default=48, help="Maximum number of CPU cores to use.")
+    args = parser.parse_args()
+
+    with open(args.config, "r", encoding="utf-8") as f:
+        config = json.load(f)
+    try:
+        validate_config(config)
+        # Built once here as well, so a missing templates or URN list file is reported before any work starts
+        build_chain(config, args.input_file)
+    except ValueError as e:
+        parser.error(str(e))
+    print("Stages: " + " -> ".join(options["stage"] for options in config["stages"]))
+
+    num_cores = max(1, min(os.cpu_count(), args.max_cpu_count))
+    start_time = time.time()
+    counts = [Counter() for _ in config["stages"]]
+    invalid_json = 0
+    written = 0
+    with open_text(args.input_file) as infile, open_text(args.output_file, "w") as outfile, \
+         ProcessPoolExecutor(max_workers=num_cores, initializer=_init_worker, initargs=(config, args.input_file)) as executor:
+
+        def write_results(result):
+            nonlocal invalid_json, written
+            output, chunk_counts, chunk_invalid = result
+            for line in output:
+                outfile.write(line + "\n")
+            written += len(output)
+            for total, stage_counts in zip(counts, chunk_counts):
+                total.update(stage_counts)
+            invalid_json += chunk_invalid
+
+        # Bounded number of chunks in flight, consumed in order
+        pending = deque()
+        for start, chunk in read_in_chunks(infile, args.chunk_size):
+            pending.append(executor.submit(run_chunk, start, chunk))
+            if len(pending) >= num_cores * 2:
+                write_results(pending.popleft().result())
+        while pending:
+            write_results(pending.popleft().result())
+
+    print_report(config, counts, invalid_json, written, time.time() - start_time)
+
+if __name__ == "__main__":
+    main()
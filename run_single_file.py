@@ -1,62 +1,418 @@
 import torch
 import argparse
+import contextlib
+import itertools
+import json
 import jsonlines
 import os
+import time
+from collections import Counter
 from transformers import AutoTokenizer, AutoModelForSequenceClassification
-from datasets import Dataset
 from tqdm import tqdm
 
+from corpus_io import COMPRESSION_SUFFIXES, base_name, open_text, recover_appendable, sidecar_parts, sync_text
+
+def read_records(input_file, skip_lines=0):
+    """
+    Yields (byte_offset, record) for every line of a jsonlines file, after the
+    first skip_lines. Compressed files cannot be seeked into, so their offsets are None.
+    """
+    if input_file.endswith(COMPRESSION_SUFFIXES):
+        with open_text(input_file) as f:
+            for line in itertools.islice(f, skip_lines, None):
+                yield None, json.loads(line)
+        return
+    with open(input_file, 'rb') as f:
+        offset = 0
+        for line_number, line in enumerate(f):
+            if line_number >= skip_lines:
+                yield offset, json.loads(line)
+            offset += len(line)
+
+def count_existing_rows(output_file):
+    # Also drops an incomplete last line or compressed frame left by a killed run, so appending is safe
+    return recover_appendable(output_file)
+
+def progress_path(output_file):
+    return output_file + ".progress.json"
+
+def read_progress(output_file):
+    """Returns (input lines, rejects) done at the last commit of a jsonlines run with --prefilter."""
+    path = progress_path(output_file)
+    if not os.path.exists(path):
+        return 0, 0
+    with open(path, "r", encoding="utf-8") as f:
+        progress = json.load(f)
+    return progress["lines_done"], progress["rejects_done"]
+
+def write_progress(output_file, lines_done, rejects_done):
+    path = progress_path(output_file)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"lines_done": lines_done, "rejects_done": rejects_done}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def sidecar_progress(path):
+    """Returns (input lines, rejects) done when the last part of a sidecar directory was committed."""
+    parts = sidecar_parts(path)
+    if not parts:
+        return 0, 0
+    import pyarrow.parquet as pq
+    metadata = pq.read_schema(parts[-1]).metadata
+    return int(metadata[b"lines_done"]), int(metadata[b"rejects_done"])
+
+def prefilter_reason(record, text_column, min_words, legal_filter, default_doc_type):
+    """
+    Returns why filter_dataset.py or filter_legal_newspapers.py would drop the
+    record anyway, or None if it should be scored.
+    """
+    text = record.get(text_column)
+    if not isinstance(text, str):
+        return "non_string_text"
+    if len(text.split()) < min_words:
+        return "min_words"
+    if legal_filter:
+        from filter_legal_newspapers import keep_document
+        # filter_dataset.py names a missing doc_type after the input file, so do the same here.
+        if not keep_document(str(record.get("id", "NO_ID")), record.get("doc_type", default_doc_type)):
+            return "licence"
+    return None
+
+def int_score_column(score_column):
+    """'score' -> 'int_score', 'ling_score' -> 'ling_int_score'."""
+    return score_column[:-len("score")] + "int_score"
+
+def tokenizer_signature(tokenizer):
+    """Equal for tokenizers that turn every text into the same ids."""
+    if tokenizer.is_fast:
+        return tokenizer.backend_tokenizer.to_str()
+    return type(tokenizer).__name__, tuple(sorted(tokenizer.get_vocab().items()))
+
+class CharBudget:
+    """
+    Adaptive character budget for pre-truncating texts before tokenization.
+
+    A text longer than max_length * chars_per_token is cut at the last
+    whitespace before that budget, so the tokenizer never sees the rest of a
+    100k-character document. If the cut text gives fewer than max_length tokens
+    the full text is tokenized instead, so the result always equals tokenizing
+    the full text, and chars_per_token is raised to 1.25 times the ratio that
+    was measured on it.
+    """
+
+    def __init__(self, max_length, chars_per_token):
+        self.max_length = max_length
+        self.chars_per_token = chars_per_token
+        self.truncated = 0
+        self.fallbacks = 0
+
+    def cut(self, text):
+        budget = int(self.max_length * self.chars_per_token)
+        if len(text) <= budget:
+            return text, False
+        cut = text[:budget]
+        space = max(cut.rfind(" "), cut.rfind("\n"))
+        return (cut[:space] if space > 0 else cut), True
+
+    def encode(self, tokenizer, texts):
+        """Returns the unpadded encodings of texts; pad subsets with tokenizer.pad."""
+        cuts = [self.cut(text) for text in texts]
+        encodings = tokenizer([cut for cut, _ in cuts], truncation=True, max_length=self.max_length)
+        fallback = [i for i, (cut, truncated) in enumerate(cuts)
+                    if truncated and len(encodings["input_ids"][i]) < self.max_length]
+        self.truncated += sum(truncated for _, truncated in cuts) - len(fallback)
+        if fallback:
+            self.fallbacks += len(fallback)
+            for i in fallback:
+                self.chars_per_token = max(self.chars_per_token, 1.25 * len(cuts[i][0]) / len(encodings["input_ids"][i]))
+            full = tokenizer([texts[i] for i in fallback], truncation=True, max_length=self.max_length)
+            for key in encodings:
+                for i, values in zip(fallback, full[key]):
+                    encodings[key][i] = values
+        return encodings
+
+def token_budget_batches(lengths, batch_size, max_tokens_per_batch=None):
+    """
+    Splits indices into batches. Without a token budget these are consecutive
+    runs of batch_size. With one, indices are sorted by length and a batch is
+    closed when padding it to its longest sequence would exceed
+    max_tokens_per_batch tokens (or it reaches batch_size).
+    """
+    if max_tokens_per_batch is None:
+        return [list(range(start, min(start + batch_size, len(lengths)))) for start in range(0, len(lengths), batch_size)]
+    batches = []
+    batch = []
+    for i in sorted(range(len(lengths)), key=lengths.__getitem__):
+        # Sorted ascending, so lengths[i] is the padded length of the batch if i joins it.
+        if batch and ((len(batch) + 1) * lengths[i] > max_tokens_per_batch or len(batch) >= batch_size):
+            batches.append(batch)
+            batch = []
+        batch.append(i)
+    if batch:
+        batches.append(batch)
+    return batches
+
+class SidecarWriter:
+    """
+    Writes id, byte offset and each score/int_score column per input line to
+    numbered Parquet parts in a directory. Windows are buffered, each with the
+    number of input lines and rejects done once it is written, until commit
+    writes them to a hidden temporary file and renames it to the next part.
+    A killed run loses only the windows since the last commit. Each part
+    records the progress of its last window, which is where a resumed run
+    continues.
+    """
+
+    def __init__(self, path, score_columns=("score",)):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self.pa = pa
+        self.pq = pq
+        fields = [("id", pa.string()), ("offset", pa.uint64())]
+        for column in score_columns:
+            fields += [(column, pa.float32()), (int_score_column(column), pa.int8())]
+        self.schema = pa.schema(fields)
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.num_parts = len(sidecar_parts(path))
+        self.lines_done, self.rejects_done = sidecar_progress(path)
+        self.pending = []
+
+    def write(self, records, offsets, columns, lines_done, rejects_done):
+        table = None
+        if records:
+            ids = [None if record.get("id") is None else str(record["id"]) for record in records]
+            arrays = [ids, offsets] + [columns[name] for name in self.schema.names[2:]]
+            table = self.pa.table(arrays, schema=self.schema)
+        # A single append, so an interruption never leaves rows buffered without the progress that counts them
+        self.pending.append((table, lines_done, rejects_done))
+
+    def commit(self):
+        if not self.pending:
+            return
+        _, lines_done, rejects_done = self.pending[-1]
+        tables = [table for table, _, _ in self.pending if table is not None]
+        table = self.pa.concat_tables(tables) if tables else self.schema.empty_table()
+        table = table.replace_schema_metadata({"lines_done": str(lines_done), "rejects_done": str(rejects_done)})
+        name = f"part-{self.num_parts:05d}.parquet"
+        # Dot-prefixed, so neither sidecar_parts nor pyarrow datasets pick up a part that was not finished
+        tmp_path = os.path.join(self.path, f".{name}.tmp")
+        with open(tmp_path, "wb") as f:
+            self.pq.write_table(table, f, compression="zstd")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, os.path.join(self.path, name))
+        self.num_parts += 1
+        self.lines_done, self.rejects_done = lines_done, rejects_done
+        self.pending = []
+
 def main(args):
-    tokenizer = AutoTokenizer.from_pretrained(args.model_name)
-    model = AutoModelForSequenceClassification.from_pretrained(args.model_name, torch_dtype=torch.bfloat16)
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    model.to(device)
+    score_columns = args.score_columns or ["score"]
 
-    # Load local jsonlines file
-    with jsonlines.open(args.input_file) as reader:
-        data = [line for line in reader]
+    # Models whose tokenizers agree share one tokenization of each batch
+    tokenizer_groups = []
+    for model_name, score_column in zip(args.model_name, score_columns):
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = AutoModelForSequenceClassification.from_pretrained(model_name, torch_dtype=torch.bfloat16)
+        model.to(device)
+        signature = tokenizer_signature(tokenizer)
+        for group in tokenizer_groups:
+            if group["signature"] == signature:
+                group["models"].append((model, score_column))
+                break
+        else:
+            tokenizer_groups.append({"signature": signature, "tokenizer": tokenizer, "models": [(model, score_column)],
+                                     "budget": CharBudget(args.max_length, args.chars_per_token)})
+    print(f"Scoring with {len(args.model_name)} model(s) using {len(tokenizer_groups)} tokenizer(s).")
 
-    # Convert list of dictionaries to dictionary of lists
-    data_dict = {key: [d[key] for d in data] for key in data[0]}
-    dataset = Dataset.from_dict(data_dict)
+    if args.legal_filter:
+        from filter_legal_newspapers import readpublicnewspaperurnfile
+        readpublicnewspaperurnfile()
+    default_doc_type = base_name(args.input_file)
 
-    # Check how many lines have already been written to the output file
-    if os.path.exists(args.output_file):
-        with open(args.output_file, 'r') as f:
-            existing_lines = sum(1 for _ in f)
+    # Check how many lines have already been processed. Scores and rejects go to separately buffered files, so with
+    # --prefilter the last commit says how far the run got, and whatever either file holds beyond it is dropped and redone.
+    existing_rejects = 0
+    if args.sidecar:
+        existing_lines, existing_rejects = sidecar_progress(args.output_file)
+    elif args.prefilter:
+        existing_lines, existing_rejects = read_progress(args.output_file)
+        if existing_lines == 0 and (count_existing_rows(args.output_file) or count_existing_rows(args.reject_file)):
+            raise ValueError(f"{args.output_file} or {args.reject_file} has lines but no {progress_path(args.output_file)} "
+                             "to resume from; remove them to start over")
+        scored_lines = existing_lines - existing_rejects
+        if recover_appendable(args.output_file, max_lines=scored_lines) < scored_lines:
+            raise ValueError(f"{args.output_file} has fewer than the {scored_lines} documents recorded in {progress_path(args.output_file)}")
+    else:
+        existing_lines = count_existing_rows(args.output_file)
+    if args.prefilter and recover_appendable(args.reject_file, max_lines=existing_rejects) < existing_rejects:
+        raise ValueError(f"{args.reject_file} has fewer than the {existing_rejects} rejects recorded for {args.output_file}")
+    if existing_lines > 0:
         print(f"Skipping {existing_lines} already processed lines.")
+
+    # Stream the input instead of loading it into memory, skipping already processed lines
+    records = read_records(args.input_file, existing_lines)
+
+    def compute_scores(texts):
+        columns = {}
+        for score_column in score_columns:
+            columns[score_column] = [None] * len(texts)
+            columns[int_score_column(score_column)] = [None] * len(texts)
+        encodings = [group["budget"].encode(group["tokenizer"], texts) for group in tokenizer_groups]
+        # Batches are formed from the first tokenizer's lengths; scores are written back by index, so output order is unchanged
+        lengths = [len(ids) for ids in encodings[0]["input_ids"]]
+        for batch in token_budget_batches(lengths, args.batch_size, args.max_tokens_per_batch):
+            for group, group_encodings in zip(tokenizer_groups, encodings):
+                subset = {key: [values[i] for i in batch] for key, values in group_encodings.items()}
+                inputs = group["tokenizer"].pad(subset, padding="longest", return_tensors="pt").to(device)
+                for model, score_column in group["models"]:
+                    with torch.no_grad():
+                        outputs = model(**inputs)
+                        logits = outputs.logits.squeeze(-1).float().cpu().numpy()
+
+                    for i, score in zip(batch, logits.tolist()):
+                        columns[score_column][i] = score
+                        columns[int_score_column(score_column)][i] = int(round(max(0, min(score, 5))))
+        return columns
+
+    # Process and write each batch incrementally; jsonlines output may be .zst or .gz compressed
+    files = contextlib.ExitStack()
+    output_file = None
+    if args.sidecar:
+        writer = SidecarWriter(args.output_file, score_columns)
     else:
-        existing_lines = 0
+        output_file = files.enter_context(open_text(args.output_file, 'a'))
+        writer = jsonlines.Writer(output_file)
+    reject_file = None
+    reject_writer = None
+    if args.prefilter:
+        reject_file = files.enter_context(open_text(args.reject_file, 'a'))
+        reject_writer = jsonlines.Writer(reject_file)
+    lines_done, rejects_done = existing_lines, existing_rejects
+    committed_lines = existing_lines
+    commits = args.sidecar or args.prefilter
 
-    # Skip already processed lines
-    if existing_lines > 0:
-        dataset = dataset.select(range(existing_lines, len(dataset)))
+    def commit():
+        nonlocal committed_lines
+        # The files reach the disk first, so a commit never counts lines a crash could lose
+        if reject_file is not None:
+            sync_text(reject_file)
+        if args.sidecar:
+            writer.commit()
+        else:
+            sync_text(output_file)
+            write_progress(args.output_file, lines_done, rejects_done)
+        committed_lines = lines_done
 
-    def compute_scores(batch):
-        inputs = tokenizer(batch[args.text_column], return_tensors="pt", padding="longest", truncation=True, max_length=args.max_length).to(device)
-        with torch.no_grad():
-            outputs = model(**inputs)
-            logits = outputs.logits.squeeze(-1).float().cpu().numpy()
+    rejected = Counter()
+    scored = 0
+    scoring_time = 0.0
+    try:
+        with tqdm(unit="lines") as progress:
+            while True:
+                batch = list(itertools.islice(records, args.lookahead or args.batch_size))
+                if not batch:
+                    break
+                progress.update(len(batch))
+                window_lines = len(batch)
+                rejects = []
+                if args.prefilter:
+                    kept = []
+                    for offset, record in batch:
+                        reason = prefilter_reason(record, args.text_column, args.min_words, args.legal_filter, default_doc_type)
+                        if reason is None:
+                            kept.append((offset, record))
+                        else:
+                            rejected[reason] += 1
+                            record["reject_reason"] = reason
+                            rejects.append(record)
+                    batch = kept
+                batch_records, offsets, columns = [], [], None
+                if batch:
+                    offsets = [offset for offset, _ in batch]
+                    batch_records = [record for _, record in batch]
+                    start_time = time.time()
+                    columns = compute_scores([record[args.text_column] for record in batch_records])
+                    scoring_time += time.time() - start_time
+                    scored += len(batch_records)
+                    if not args.sidecar:
+                        for score_column in score_columns:
+                            for record, score, int_score in zip(batch_records, columns[score_column], columns[int_score_column(score_column)]):
+                                record[score_column] = score
+                                record[int_score_column(score_column)] = int_score
+                        writer.write_all(batch_records)
+                if rejects:
+                    reject_writer.write_all(rejects)
+                # One assignment once the window is written, so a commit on interruption counts all of it or none
+                lines_done, rejects_done = lines_done + window_lines, rejects_done + len(rejects)
+                if args.sidecar:
+                    # After its rejects, so a commit never counts rejects that were not written
+                    writer.write(batch_records, offsets, columns, lines_done, rejects_done)
+                if commits and lines_done - committed_lines >= args.commit_lines:
+                    commit()
+    finally:
+        if commits:
+            commit()
+        if not args.sidecar:
+            writer.close()
+        if reject_writer is not None:
+            reject_writer.close()
+        files.close()
 
-        batch["score"] = logits.tolist()
-        batch["int_score"] = [int(round(max(0, min(score, 5)))) for score in logits]
-        return batch
+    if args.prefilter:
+        total_rejected = sum(rejected.values())
+        total = scored + total_rejected
+        print(f"Prefilter rejected {total_rejected} of {total} documents ({total_rejected / max(total, 1):.1%}): "
+              + ", ".join(f"{reason} {count}" for reason, count in rejected.most_common()))
+        if scored:
+            print(f"Estimated inference saved: {total_rejected * scoring_time / scored:.0f} seconds "
+                  f"(at {scoring_time / scored * 1000:.2f} ms per scored document).")
 
-    # Process and write each batch incrementally
-    with jsonlines.open(args.output_file, mode='a') as writer:
-        for batch in tqdm(dataset.iter(batch_size=args.batch_size), total=(len(dataset) + args.batch_size - 1) // args.batch_size):
-            processed_batch = compute_scores(batch)
-            writer.write_all([dict(zip(batch.keys(), vals)) for vals in zip(*processed_batch.values())])
+    for group in tokenizer_groups:
+        budget = group["budget"]
+        print(f"Pre-truncated {budget.truncated} long documents to {int(budget.max_length * budget.chars_per_token)} characters; "
+              f"{budget.fallbacks} needed the full text (chars per token bound {budget.chars_per_token:.2f}).")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
 
-    parser.add_argument("--model_name", type=str, default="north/scandinavian_education_classifier_bert")
+    parser.add_argument("--model_name", type=str, nargs="+", default=["north/scandinavian_education_classifier_bert"], help="One or more classifiers to run over each batch")
+    parser.add_argument("--score_columns", type=str, nargs="+", help="Output column per --model_name, e.g. score ling_score. Each also gets an int column (ling_score -> ling_int_score). Defaults to score for a single model")
     parser.add_argument("--input_file", type=str, required=True, help="Path to the input jsonlines file")
-    parser.add_argument("--output_file", type=str, required=True, help="Path to save the output jsonlines file")
+    parser.add_argument("--output_file", type=str, required=True, help="Path to save the output jsonlines file, or the directory of Parquet sidecar parts with --sidecar")
     parser.add_argument("--text_column", type=str, default="text")
     parser.add_argument("--max_length", type=int, default=512, help="Maximum sequence length for tokenization")
     parser.add_argument("--batch_size", type=int, default=1024, help="Batch size for processing")
+    parser.add_argument("--max_tokens_per_batch", type=int, help="Form batches by padded token count instead of a fixed size: documents are sorted by length within --lookahead and each batch is capped at this many tokens (and --batch_size documents)")
+    parser.add_argument("--lookahead", type=int, help="Number of documents read and length-sorted at a time with --max_tokens_per_batch. Defaults to --batch_size, or 16 times it with a token budget")
+    parser.add_argument("--chars_per_token", type=float, default=8.0, help="Initial characters per token used to pre-truncate long texts to max_length * chars_per_token characters. Raised automatically when too low")
+    parser.add_argument("--prefilter", action="store_true", help="Before scoring, reject documents filter_dataset.py would drop anyway (non-string text, fewer than --min_words words) and write them to --reject_file")
+    parser.add_argument("--reject_file", type=str, help="Jsonlines file for documents rejected by --prefilter, each with a reject_reason")
+    parser.add_argument("--min_words", type=int, default=10, help="Minimum number of words for --prefilter, as in filter_dataset.py")
+    parser.add_argument("--legal_filter", action="store_true", help="With --prefilter, also reject documents filter_legal_newspapers.py would drop. Needs publicurnnewspaper.lst in the working directory")
+    parser.add_argument("--sidecar", action="store_true", help="Write only id, byte offset and the score columns per input line to Parquet parts in --output_file instead of copying every document. Use filter_by_sidecar.py to select documents from them.")
+    parser.add_argument("--commit_lines", type=int, default=100000, help="With --sidecar or --prefilter, commit progress (a new sidecar part, or the jsonlines and reject files with a .progress.json marker) after this many input lines. A killed run redoes at most this many lines when resumed")
 
     args = parser.parse_args()
+    if args.score_columns is None and len(args.model_name) > 1:
+        parser.error("--score_columns is required with more than one --model_name")
+    if args.score_columns is not None and len(args.score_columns) != len(args.model_name):
+        parser.error("--score_columns needs one name per --model_name")
+    if args.score_columns is not None and not all(column.endswith("score") for column in args.score_columns):
+        parser.error("--score_columns names must end with 'score'")
+    if args.max_tokens_per_batch is not None and args.max_tokens_per_batch < args.max_length:
+        parser.error("--max_tokens_per_batch must be at least --max_length")
+    if args.prefilter and not args.reject_file:
+        parser.error("--prefilter needs --reject_file, so that resuming can count the rejected lines")
+    if args.sidecar and args.input_file.endswith(COMPRESSION_SUFFIXES):
+        parser.error("--sidecar stores byte offsets into --input_file, which needs to be uncompressed")
+    if args.commit_lines < 1:
+        parser.error("--commit_lines must be at least 1")
+    if args.legal_filter and not args.prefilter:
+        parser.error("--legal_filter is applied by --prefilter")
+    if args.lookahead is None and args.max_tokens_per_batch is not None:
+        args.lookahead = 16 * args.batch_size
     main(args)
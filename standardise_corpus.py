@@ -4,42 +4,64 @@ import os
 import uuid
 import pandas as pd
 
-def process_jsonl(input_file, output_folder):
-    doc_type = os.path.splitext(os.path.basename(input_file))[0]
-    output_name = os.path.join(output_folder, os.path.basename(input_file))
+from corpus_io import DEFAULT_ROW_GROUP_SIZE, ParquetRecordWriter, base_name, corpus_schema, open_text
+
+def standardise_record(data, idx, doc_type):
+    """Maps the decoded record on line idx (from 0) of the input to the standardised fields."""
+    if "text" not in data:
+        raise ValueError(f"Missing 'text' field in the input file at line {idx + 1}")
+
+    # Determine the id
+    if 'id' in data:
+        data_id = data['id']
+    elif 'uuid' in data:
+        data_id = data['uuid']
+    else:
+        data_id = idx + 1
+
+    return {
+        "id": f"{doc_type}_{data_id}",
+        "text": data["text"],
+        "edu_score": data.get("edu_score", float('nan')),
+        "ling_score": data.get("ling_score", float('nan')),
+        "doc_type": doc_type
+    }
+
+def standardise_records(input_file):
+    doc_type = base_name(input_file)
 
-    with open(input_file, 'r') as infile, open(output_name, 'w') as outfile:
+    with open_text(input_file) as infile:
         for idx, line in enumerate(infile):
             try:
                 data = json.loads(line)
-                
-                # Determine the id
-                if 'id' in data:
-                    data_id = data['id']
-                elif 'uuid' in data:
-                    data_id = data['uuid']
-                else:
-                    data_id = idx + 1
-                
-                output_data = {
-                    "id": f"{doc_type}_{data_id}",
-                    "text": data["text"],
-                    "edu_score": data.get("edu_score", float('nan')),
-                    "ling_score": data.get("ling_score", float('nan')),
-                    "doc_type": doc_type
-                }
-                
-                outfile.write(json.dumps(output_data) + '\n')
-            except KeyError:
-                raise ValueError(f"Missing 'text' field in the input file at line {idx + 1}")
             except json.JSONDecodeError:
                 raise ValueError(f"Invalid JSON format at line {idx + 1}")
+            yield standardise_record(data, idx, doc_type)
+
+def process_jsonl(input_file, output_folder):
+    output_name = os.path.join(output_folder, os.path.basename(input_file))
+
+    with open_text(output_name, 'w') as outfile:
+        for output_data in standardise_records(input_file):
+            outfile.write(json.dumps(output_data) + '\n')
+
+def process_parquet(input_file, output_folder, row_group_size=DEFAULT_ROW_GROUP_SIZE):
+    output_name = os.path.join(output_folder, base_name(input_file) + '.parquet')
+
+    with ParquetRecordWriter(output_name, corpus_schema(), row_group_size) as writer:
+        for output_data in standardise_records(input_file):
+            writer.write(output_data)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Process a JSONL file to extract specific fields.")
     parser.add_argument("--input_file", required=True, help="The input JSONL file")
     parser.add_argument("--output_folder", required=True, help="The output folder for the processed file")
+    parser.add_argument("--output_format", choices=["jsonl", "parquet"], default="jsonl", help="Write JSONL, or zstd-compressed Parquet with native score columns")
+    parser.add_argument("--row_group_size", type=int, default=DEFAULT_ROW_GROUP_SIZE, help="Rows per Parquet row group")
     
     args = parser.parse_args()
     
-    process_jsonl(args.input_file, args.output_folder)
+    if args.output_format == "parquet":
+        process_parquet(args.input_file, args.output_folder, args.row_group_size)
+    else:
+        process_jsonl(args.input_file, args.output_folder)
@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+"""
+Linear-time validators for the Llama3 and Gemma2 prompt templates.
+
+These replace the backtracking regexes in validate_llama3_template.py,
+validate_gamma2_template.py and convert_alignment_llama3_to_gemma2.py. Each
+validator scans the prompt once over its special tokens and accepts exactly
+the same prompts as the regex it replaces. Note that those regexes use a lazy
+`.*?` for the message text, so a message may itself contain special tokens;
+the validators keep that behaviour rather than tightening it.
+
+Every validator returns (is_valid, message, position), where position is the
+character offset of the first problem in the prompt, or None when valid.
+
+Run this file with --benchmark to compare against the old regexes on long
+adversarial prompts.
+"""
+
+import argparse
+import re
+import time
+
+BEGIN_OF_TEXT = "<|begin_of_text|>"
+END_OF_TEXT = "<|end_of_text|>"
+START_HEADER = "<|start_header_id|>"
+END_HEADER = "<|end_header_id|>"
+EOT = "<|eot_id|>"
+
+START_OF_TURN = "<start_of_turn>"
+END_OF_TURN = "<end_of_turn>"
+GEMMA2_ROLES = ("user", "model")
+
+def _skip_whitespace(text, pos, end):
+    while pos < end and text[pos].isspace():
+        pos += 1
+    return pos
+
+def _rskip_whitespace(text, start, end):
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return end
+
+def _parse_llama3_header(text, pos, end, roles):
+    """
+    Parses '<|start_header_id|> role <|end_header_id|>' at pos, allowing
+    whitespace around the role. Returns (role, end_pos) on success and
+    (None, error_pos) on failure.
+    """
+    if not text.startswith(START_HEADER, pos, end):
+        return None, pos
+    p = _skip_whitespace(text, pos + len(START_HEADER), end)
+    for role in roles:
+        if text.startswith(role, p, end):
+            q = _skip_whitespace(text, p + len(role), end)
+            if text.startswith(END_HEADER, q, end):
+                return role, q + len(END_HEADER)
+            return None, q
+    return None, p
+
+def validate_llama3_prompt(prompt):
+    """
+    Loosened Llama3 check used by validate_llama3_template.py: an optional
+    system turn, at least one user turn and optional assistant turns, with
+    any whitespace around tokens.
+    """
+    if not prompt.startswith(BEGIN_OF_TEXT):
+        return False, f"Prompt does not start with '{BEGIN_OF_TEXT}'.", 0
+    if not prompt.endswith(END_OF_TEXT):
+        return False, f"Prompt does not end with '{END_OF_TEXT}'.", len(prompt)
+
+    # Same span as prompt[len(BEGIN_OF_TEXT):-len(END_OF_TEXT)].strip()
+    inner_end = len(prompt) - len(END_OF_TEXT)
+    start = _skip_whitespace(prompt, len(BEGIN_OF_TEXT), inner_end)
+    end = _rskip_whitespace(prompt, start, inner_end)
+
+    role, pos = _parse_llama3_header(prompt, start, end, ("system", "user"))
+    if role is None:
+        return False, "Expected a system or user header.", pos
+
+    if role == "system":
+        # The system turn runs until an <|eot_id|> that is followed by a user header.
+        eot = prompt.find(EOT, pos, end)
+        while eot != -1:
+            p = _skip_whitespace(prompt, eot + len(EOT), end)
+            user_role, user_end = _parse_llama3_header(prompt, p, end, ("user",))
+            if user_role is not None:
+                pos = user_end
+                break
+            eot = prompt.find(EOT, eot + 1, end)
+        else:
+            return False, "System turn is not followed by a user turn.", pos
+
+    if end - len(EOT) < pos or not prompt.startswith(EOT, end - len(EOT), end):
+        return False, f"Last turn does not end with '{EOT}'.", end
+    return True, "Valid format.", None
+
+def validate_llama3_wrapped(prompt):
+    """
+    Llama3 check used by convert_alignment_llama3_to_gemma2.py: one or more
+    '<|start_header_id|>role<|end_header_id|>message<|eot_id|>' turns with
+    non-empty role and message, wrapped in begin/end of text tokens.
+    """
+    n = len(prompt)
+    if not prompt.startswith(BEGIN_OF_TEXT):
+        return False, f"Prompt does not start with '{BEGIN_OF_TEXT}'.", 0
+    pos = _skip_whitespace(prompt, len(BEGIN_OF_TEXT), n)
+    if not prompt.startswith(START_HEADER, pos):
+        return False, f"Expected '{START_HEADER}'.", pos
+    role_start = pos + len(START_HEADER)
+
+    if prompt.endswith(END_OF_TEXT):
+        end = n - len(END_OF_TEXT)
+    elif prompt.endswith(END_OF_TEXT + "\n"):
+        end = n - 1 - len(END_OF_TEXT)
+    else:
+        return False, f"Prompt does not end with '{END_OF_TEXT}'.", n
+    end = _rskip_whitespace(prompt, role_start, end)
+    eot_start = end - len(EOT)
+    if eot_start < role_start or not prompt.startswith(EOT, eot_start, end):
+        return False, f"Last turn does not end with '{EOT}'.", end
+
+    header_end = prompt.find(END_HEADER, role_start + 1, eot_start)
+    if header_end == -1 or header_end + len(END_HEADER) > eot_start - 1:
+        return False, f"Header is missing a role, '{END_HEADER}' or a message.", role_start
+    return True, "Valid format.", None
+
+def _parse_gemma2_header(prompt):
+    if not prompt.startswith(START_OF_TURN):
+        return None, 0
+    pos = len(START_OF_TURN)
+    for role in GEMMA2_ROLES:
+        if prompt.startswith(role + "\n", pos):
+            return role, pos + len(role) + 1
+    return None, pos
+
+def validate_gemma2_prompt(prompt):
+    """
+    Strict Gemma2 check used by validate_gamma2_template.py: one or more
+    '<start_of_turn>role\\nmessage<end_of_turn>' turns, each optionally
+    followed by a newline.
+    """
+    role, pos = _parse_gemma2_header(prompt)
+    if role is None:
+        return False, "Prompt does not start with a '<start_of_turn>user' or '<start_of_turn>model' line.", pos
+
+    end = len(prompt)
+    # A trailing '\n?' plus the single newline that '$' tolerates.
+    for trailing in ("", "\n", "\n\n"):
+        if prompt.endswith(END_OF_TURN + trailing) and end - len(trailing) - len(END_OF_TURN) >= pos:
+            return True, "Valid Gemma2 format.", None
+    return False, f"Last turn does not end with '{END_OF_TURN}'.", end
+
+def validate_gemma2_relaxed(prompt):
+    """
+    Relaxed Gemma2 check used by convert_alignment_llama3_to_gemma2.py: the
+    message is followed by a newline before '<end_of_turn>' and any
+    whitespace may follow a turn.
+    """
+    role, pos = _parse_gemma2_header(prompt)
+    if role is None:
+        return False, "Prompt does not start with a '<start_of_turn>user' or '<start_of_turn>model' line.", pos
+
+    end = _rskip_whitespace(prompt, 0, len(prompt))
+    closing = "\n" + END_OF_TURN
+    if end - len(closing) < pos or not prompt.startswith(closing, end - len(closing), end):
+        return False, f"Last turn does not end with a newline and '{END_OF_TURN}'.", end
+    return True, "Valid Gemma2 format.", None
+
+# The regexes these validators replace, kept for the benchmark.
+LEGACY_PATTERNS = {
+    "llama3": (
+        r"^(?:(<\|start_header_id\|>\s*system\s*<\|end_header_id\|>\s*.*?\s*<\|eot_id\|>\s*))?"
+        r"((<\|start_header_id\|>\s*user\s*<\|end_header_id\|>\s*.*?\s*<\|eot_id\|>\s*))+"
+        r"((<\|start_header_id\|>\s*assistant\s*<\|end_header_id\|>\s*.*?\s*<\|eot_id\|>\s*))*$"
+    ),
+    "llama3_wrapped": r"^<\|begin_of_text\|>(\s*<\|start_header_id\|>.+?<\|end_header_id\|>.+?<\|eot_id\|>\s*)+<\|end_of_text\|>$",
+    "gemma2": r"^(?:<start_of_turn>(user|model)\n.*?<end_of_turn>\n?)+$",
+    "gemma2_relaxed": r"^(<start_of_turn>(user|model)\n.*?\n<end_of_turn>\s*)+$",
+}
+
+VALIDATORS = {
+    "llama3": validate_llama3_prompt,
+    "llama3_wrapped": validate_llama3_wrapped,
+    "gemma2": validate_gemma2_prompt,
+    "gemma2_relaxed": validate_gemma2_relaxed,
+}
+
+def legacy_validate(name, prompt):
+    if name == "llama3":
+        if not (prompt.startswith(BEGIN_OF_TEXT) and prompt.endswith(END_OF_TEXT)):
+            return False
+        prompt = prompt[len(BEGIN_OF_TEXT):-len(END_OF_TEXT)].strip()
+    return re.match(LEGACY_PATTERNS[name], prompt, re.DOTALL) is not None
+
+def adversarial_prompts(turns, message_length):
+    """Long multi-turn prompts that only fail at the very end, which is where the regexes backtrack."""
+    message = ("Dette er en lang melding. " * (message_length // 26 + 1))[:message_length]
+    llama3_turns = "".join(
+        f"{START_HEADER}{'user' if i % 2 == 0 else 'assistant'}{END_HEADER}\n\n{message}{EOT}\n"
+        for i in range(turns)
+    )
+    gemma2_turns = "".join(
+        f"{START_OF_TURN}{'user' if i % 2 == 0 else 'model'}\n{message}\n{END_OF_TURN}\n"
+        for i in range(turns)
+    )
+    return {
+        "llama3": BEGIN_OF_TEXT + llama3_turns + "trailing text" + END_OF_TEXT,
+        "llama3_wrapped": BEGIN_OF_TEXT + llama3_turns + "trailing text" + END_OF_TEXT,
+        "gemma2": gemma2_turns + "trailing text",
+        "gemma2_relaxed": gemma2_turns + "trailing text",
+    }
+
+def benchmark(turns, message_length, repeat):
+    prompts = adversarial_prompts(turns, message_length)
+    print(f"Adversarial prompts: {turns} turns, {message_length} chars per message, best of {repeat} runs")
+    print("| Template | Prompt chars | Regex (s) | Scanner (s) | Speedup | Same decision |")
+    print("| --- | ---: | ---: | ---: | ---: | --- |")
+    for name, prompt in prompts.items():
+        timings = {}
+        for label, check in (("regex", lambda: legacy_validate(name, prompt)),
+                             ("scanner", lambda: VALIDATORS[name](prompt)[0])):
+            best = None
+            for _ in range(repeat):
+                start = time.perf_counter()
+                decision = check()
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            timings[label] = (best, decision)
+        regex_time, regex_decision = timings["regex"]
+        scan_time, scan_decision = timings["scanner"]
+        speedup = regex_time / scan_time if scan_time > 0 else float("inf")
+        print(f"| {name} | {len(prompt)} | {regex_time:.4f} | {scan_time:.6f} | {speedup:.0f}x | "
+              f"{'yes' if regex_decision == scan_decision else 'NO'} |")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the linear-time template validators against the old regexes.")
+    parser.add_argument("--benchmark", action="store_true", help="Run the benchmark.")
+    parser.add_argument("--turns", type=int, default=8,
+                        help="Number of turns in each adversarial prompt. Regex time grows exponentially with this; "
+                             "10 turns already takes seconds per prompt.")
+    parser.add_argument("--message_length", type=int, default=500, help="Characters per message.")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of timed runs per validator.")
+    args = parser.parse_args()
+    if args.benchmark:
+        benchmark(args.turns, args.message_length, args.repeat)
+    else:
+        parser.print_help()
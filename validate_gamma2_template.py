@@ -1,8 +1,10 @@
 #!/usr/bin/env python
-import re
 import json
 import argparse
 
+from corpus_io import open_text
+from template_validators import validate_gemma2_prompt
+
 def validate_gemma2_format(prompt):
     """
     Validates that the prompt follows the Gemma2 template.
@@ -13,24 +15,19 @@ def validate_gemma2_format(prompt):
     [message text]<end_of_turn>
     
     Where role is either 'user' or 'model'. Multi-turn prompts are allowed.
-    The regex requires the entire prompt to be one or more such blocks.
+    The entire prompt must be one or more such blocks.
     """
-    # Define a regex pattern that matches one or more turns in Gemma2 format.
-    # Each turn starts with <start_of_turn> followed immediately by 'user' or 'model',
-    # a newline, then any message text (non-greedy), then <end_of_turn>.
-    pattern = r"^(?:<start_of_turn>(user|model)\n.*?<end_of_turn>\n?)+$"
-    
-    if re.match(pattern, prompt, re.DOTALL):
+    is_valid, message, position = validate_gemma2_prompt(prompt)
+    if is_valid:
         return True, "Valid Gemma2 format."
-    else:
-        return False, "Prompt does not match the strict Gemma2 template."
+    return False, f"Prompt does not match the strict Gemma2 template: {message} (at offset {position})"
 
 def main(input_file):
     """
     Reads a JSONL file and validates the 'text' field in each JSON object using the Gemma2 format.
     Prints detailed error messages for invalid prompts.
     """
-    with open(input_file, "r", encoding="utf-8") as file:
+    with open_text(input_file) as file:
         for line_number, line in enumerate(file, start=1):
             try:
                 data = json.loads(line.strip())
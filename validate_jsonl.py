@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Single-pass JSONL validator.
+
+Runs a set of pluggable per-line rules over every line of each file in one
+pass, with files spread over a process pool, and aggregates the results into
+one report. This replaces running check_jsonl_errors.py, check_malformed_data.py,
+validate_llama3_template.py and validate_gamma2_template.py one after another.
+
+Each rule takes the decoded record and the parsed arguments and returns an
+error message, or None when the line passes.
+"""
+
+import argparse
+import glob
+import json
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from corpus_io import list_jsonl_files, open_text
+
+from validate_llama3_template import validate_prompt_format
+from validate_gamma2_template import validate_gemma2_format
+
+def rule_text_type(record, args):
+    if not isinstance(record.get("text"), str):
+        return "'text' field is not a string."
+    return None
+
+def rule_empty_fields(record, args):
+    for k, v in record.items():
+        if isinstance(v, str) and v.strip() == "":
+            return f"Field '{k}' is empty."
+    return None
+
+def rule_max_length(record, args):
+    for k, v in record.items():
+        if isinstance(v, str) and len(v) > args.max_text_length:
+            return f"Field '{k}' has {len(v)} characters, exceeds {args.max_text_length} chars."
+    return None
+
+def rule_encoding(record, args):
+    for k, v in record.items():
+        if isinstance(v, str) and "�" in v:
+            return f"Field '{k}' contains a replacement character."
+    return None
+
+def rule_llama3(record, args):
+    text = record.get("text", "")
+    if not text:
+        return "Missing 'text' field."
+    if not isinstance(text, str):
+        return "'text' field is not a string."
+    is_valid, message = validate_prompt_format(text)
+    return None if is_valid else message
+
+def rule_gemma2(record, args):
+    text = record.get("text", "")
+    if not text:
+        return "Missing 'text' field."
+    if not isinstance(text, str):
+        return "'text' field is not a string."
+    is_valid, message = validate_gemma2_format(text)
+    return None if is_valid else message
+
+# JSON validity is always checked first; a line that does not decode to an
+# object is reported under "json" and the remaining rules are skipped.
+RULES = {
+    "text_type": rule_text_type,
+    "empty_fields": rule_empty_fields,
+    "max_length": rule_max_length,
+    "encoding": rule_encoding,
+    "llama3": rule_llama3,
+    "gemma2": rule_gemma2,
+}
+
+DEFAULT_RULES = ["text_type", "empty_fields", "max_length"]
+
+def validate_file(filepath, rule_names, args):
+    """Validates one file in a single pass and returns its report dict."""
+    rules = [(name, RULES[name]) for name in rule_names]
+    counts = Counter()
+    examples = []
+    total_lines = 0
+    bad_lines = 0
+
+    def record_error(line_number, rule, message):
+        counts[rule] += 1
+        if len(examples) < args.max_examples:
+            examples.append({"line": line_number, "rule": rule, "message": message})
+        if args.verbose:
+            print(f"{filepath}:{line_number}: [{rule}] {message}")
+
+    try:
+        with open_text(filepath) as f:
+            for line_number, line in enumerate(f, start=1):
+                total_lines += 1
+                stripped = line.strip()
+                if not stripped:
+                    record_error(line_number, "json", "Empty line.")
+                    bad_lines += 1
+                    continue
+                try:
+                    record = json.loads(stripped)
+                except json.JSONDecodeError as e:
+                    record_error(line_number, "json", f"JSON parse error -> {e}")
+                    bad_lines += 1
+                    continue
+                if not isinstance(record, dict):
+                    record_error(line_number, "json", "Line is not a JSON object.")
+                    bad_lines += 1
+                    continue
+
+                line_ok = True
+                for name, rule in rules:
+                    message = rule(record, args)
+                    if message is not None:
+                        record_error(line_number, name, message)
+                        line_ok = False
+                if not line_ok:
+                    bad_lines += 1
+    except (OSError, UnicodeDecodeError) as e:
+        print(f"Error reading file {filepath}: {e}")
+        return {"file": filepath, "total_lines": total_lines, "bad_lines": bad_lines,
+                "errors": dict(counts), "examples": examples, "read_error": str(e)}
+
+    print(f"Checked {filepath}: {bad_lines} bad lines in {total_lines} lines.")
+    return {"file": filepath, "total_lines": total_lines, "bad_lines": bad_lines,
+            "errors": dict(counts), "examples": examples}
+
+def collect_files(patterns):
+    files = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            files.extend(list_jsonl_files(pattern))
+            continue
+        matched = sorted(glob.glob(pattern))
+        if matched:
+            files.extend(matched)
+        else:
+            print(f"No files matched pattern: {pattern}")
+    return files
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Validate JSONL files with a set of per-line rules in a single parallel pass."
+    )
+    parser.add_argument("--input_file", required=True, nargs="+",
+                        help="Files, directories or glob patterns of JSONL files.")
+    parser.add_argument("--rules", nargs="+", choices=sorted(RULES), default=DEFAULT_RULES,
+                        help="Rules to apply to each line. JSON validity is always checked.")
+    parser.add_argument("--max_text_length", type=int, default=10000,
+                        help="Threshold used by the max_length rule.")
+    parser.add_argument("--max_cpu_count", type=int, default=48,
+                        help="Maximum number of files validated concurrently.")
+    parser.add_argument("--max_examples", type=int, default=20,
+                        help="Number of example errors kept per file in the report.")
+    parser.add_argument("--report_file", type=str, help="Write the full JSON report to this path.")
+    parser.add_argument("--verbose", action="store_true", help="Print every error as it is found.")
+    args = parser.parse_args()
+
+    files = collect_files(args.input_file)
+    if not files:
+        print("No files found for the provided pattern(s).")
+        return
+
+    num_workers = max(1, min(os.cpu_count(), args.max_cpu_count, len(files)))
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        reports = list(executor.map(validate_file, files,
+                                    [args.rules] * len(files), [args] * len(files)))
+
+    totals = Counter()
+    for report in reports:
+        totals.update(report["errors"])
+    total_lines = sum(r["total_lines"] for r in reports)
+    bad_lines = sum(r["bad_lines"] for r in reports)
+
+    print(f"\nOverall summary: Processed {len(files)} files, {total_lines} lines total, {bad_lines} bad lines.")
+    for rule in ["json"] + args.rules:
+        print(f"  {rule}: {totals.get(rule, 0)}")
+
+    if args.report_file:
+        with open(args.report_file, "w", encoding="utf-8") as f:
+            json.dump({
+                "rules": ["json"] + args.rules,
+                "files": reports,
+                "totals": {"files": len(files), "total_lines": total_lines,
+                           "bad_lines": bad_lines, "errors": dict(totals)},
+            }, f, indent=2)
+        print(f"Report saved to {args.report_file}")
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,9 @@
-import re
 import argparse
 import json
 
+from corpus_io import open_text
+from template_validators import validate_llama3_prompt
+
 def validate_prompt_format(prompt):
     """
     Validates the Llama 3 prompt format with loosened requirements for whitespace.
@@ -16,30 +18,18 @@ def validate_prompt_format(prompt):
     if not prompt.endswith(expected_end):
         return False, f"Prompt does not end with '{expected_end}'."
     
-    # Remove wrapping tokens and trim surrounding whitespace
-    core_prompt = prompt[len(expected_start):-len(expected_end)].strip()
-    
-    # Loosen the regex by allowing any whitespace (\s*) around tokens.
-    # Optional system block:
-    system_pattern = r"(?:(<\|start_header_id\|>\s*system\s*<\|end_header_id\|>\s*.*?\s*<\|eot_id\|>\s*))?"
-    # At least one user block is required:
-    user_pattern = r"((<\|start_header_id\|>\s*user\s*<\|end_header_id\|>\s*.*?\s*<\|eot_id\|>\s*))+"
-    # Optional assistant block(s):
-    assistant_pattern = r"((<\|start_header_id\|>\s*assistant\s*<\|end_header_id\|>\s*.*?\s*<\|eot_id\|>\s*))*"
-    
-    full_pattern = f"^{system_pattern}{user_pattern}{assistant_pattern}$"
-    
-    if not re.match(full_pattern, core_prompt, re.DOTALL):
-        return False, "Prompt structure does not match the expected (loosened) format."
-    
-    return True, "Valid format."
+    # Single linear scan; accepts the same prompts as the old loosened regex.
+    is_valid, message, position = validate_llama3_prompt(prompt)
+    if is_valid:
+        return True, "Valid format."
+    return False, f"Prompt structure does not match the expected (loosened) format: {message} (at offset {position})"
 
 def main(input_file):
     """
     Reads a JSONL file and validates the 'text' field in each JSON object.
     Prints detailed error messages for invalid prompts.
     """
-    with open(input_file, 'r', encoding='utf-8') as file:
+    with open_text(input_file) as file:
         for line_number, line in enumerate(file, start=1):
             try:
                 data = json.loads(line.strip())